@@ -1,5 +1,7 @@
 # Delete all whirling track analysis files.
 find data -name "*.p" -type f -delete
+find data -name "*.dnz" -type f -delete
+rm -rf data/cache/artifacts
 
 # Delete python cache files
 find . | grep -E "(__pycache__|\.pyc|\.pyo$)" | xargs rm -rf
\ No newline at end of file
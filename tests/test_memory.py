@@ -0,0 +1,67 @@
+"""Tests for the worker memory estimates."""
+
+import os
+import json
+import tempfile
+import unittest
+from whirling.cache_builder.memory import MemoryModel, PROFILE_NAME
+
+
+def growth_mb(duration):
+    """How much a worker grows on a track after its first one."""
+    return 10 + 0.05 * duration
+
+
+class TestMemoryModel(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cache_dir = self.tmp_dir.name
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write_profile(self, records):
+        with open(os.path.join(self.cache_dir, PROFILE_NAME), 'w', encoding='utf-8') as f:
+            for record in records:
+                record['families'] = ['full']
+                f.write(json.dumps(record) + '\n')
+
+    def test_first_track_load_isnt_a_per_second_cost(self):
+        """A worker's first track jumps by what it loads once. That has to
+        stay out of the per second cost or long tracks get estimated at many
+        times what they take."""
+        records = [{'track': 'first.mp3', 'duration': 30, 'start_mb': 141, 'peak_mb': 197,
+                    'first': True}]
+        for i, duration in enumerate([120, 180, 240, 300]):
+            records.append({'track': f'{i}.mp3', 'duration': duration,
+                            'start_mb': 197, 'peak_mb': 197 + growth_mb(duration)})
+        self.write_profile(records)
+
+        model = MemoryModel(self.cache_dir, ['full'])
+        model.durations = {r['track']: r['duration'] for r in records}
+        model.durations['long.mp3'] = 1200
+
+        # Every measured peak is covered, the first one's too since it
+        # started out below the baseline.
+        for r in records:
+            self.assertGreaterEqual(model.estimate_mb(r['track']), r['peak_mb'])
+
+        # The worst ratio, 56 MB over 30 s, would put this at over 2 GB.
+        needed_mb = model.estimate_mb('long.mp3') - model.baseline_mb
+        self.assertGreaterEqual(needed_mb, growth_mb(1200))
+        self.assertLess(needed_mb, 1.5 * growth_mb(1200))
+
+    def test_single_duration_keeps_default_rate(self):
+        """Measurements all of one duration can't give a slope."""
+        self.write_profile([{'track': 'a.mp3', 'duration': 60, 'start_mb': 100,
+                             'peak_mb': 400}])
+        model = MemoryModel(self.cache_dir, ['full'])
+        default_mb_per_second = model.default_mb_per_second
+        self.assertAlmostEqual(model.mb_per_second, default_mb_per_second)
+        model.durations = {'a.mp3': 60}
+        self.assertGreaterEqual(model.estimate_mb('a.mp3'), 400)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,24 @@
+"""Tests for the track locks that keep hosts off each other's tracks."""
+
+import os
+import tempfile
+import unittest
+from whirling.cache_builder.shards import TrackLocks
+
+
+class TestTrackLocks(unittest.TestCase):
+
+    def test_acquire_in_empty_cache_dir(self):
+        """A lock can be taken before the cache dir it lives in exists."""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            lock_name = os.path.join(tmp_dir, 'cache', 'track.dnz.lock')
+            locks = TrackLocks()
+            self.assertTrue(locks.acquire(lock_name))
+            self.assertTrue(os.path.exists(lock_name))
+            self.assertFalse(TrackLocks().acquire(lock_name))
+            locks.release(lock_name)
+            self.assertFalse(os.path.exists(lock_name))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+"""Tests for the background track loader."""
+
+import time
+import threading
+import unittest
+from whirling.track_loader import TrackLoader
+
+
+def poll_until(loader, timeout=5):
+    """Poll the loader until something finishes or timeout seconds pass."""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        finished = loader.poll()
+        if finished:
+            return finished
+        time.sleep(0.01)
+    return []
+
+
+class BlockingLoad():
+    """A load function that holds the first load until released. Only the
+    cached tracks load without generating."""
+
+    def __init__(self, cached=()):
+        self.cached = set(cached)
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.calls = []
+
+    def __call__(self, track_name, plan, generate):
+        self.calls.append((track_name, plan, generate))
+        if len(self.calls) == 1:
+            self.started.set()
+            self.release.wait(5)
+        if not generate and track_name not in self.cached:
+            return None
+        return {'plan': plan, 'signals': {}}
+
+
+class TestTrackLoader(unittest.TestCase):
+
+    def test_plan_edited_while_load_in_flight(self):
+        """The track gets loaded again with the new plan and the output from
+        the old plan never reaches the main loop."""
+        load_fn = BlockingLoad()
+        loader = TrackLoader(load_fn)
+        old_plan, new_plan = {'v': 1}, {'v': 2}
+
+        loader.load('a.mp3', old_plan)
+        self.assertTrue(load_fn.started.wait(5))
+
+        loader.clear_prefetched()
+        loader.load('a.mp3', new_plan)
+        load_fn.release.set()
+
+        finished = poll_until(loader)
+        self.assertEqual(finished, [('a.mp3', {'plan': new_plan, 'signals': {}})])
+        self.assertEqual(load_fn.calls, [('a.mp3', old_plan, True),
+                                         ('a.mp3', new_plan, True)])
+        self.assertFalse(loader.is_loading)
+
+    def test_prefetch_with_old_plan_is_dropped(self):
+        """A prefetch finishing after the plan changed isn't handed out."""
+        load_fn = BlockingLoad(cached=['b.mp3'])
+        loader = TrackLoader(load_fn)
+        old_plan, new_plan = {'v': 1}, {'v': 2}
+
+        loader.prefetch(['b.mp3'], old_plan)
+        self.assertTrue(load_fn.started.wait(5))
+        loader.clear_prefetched()
+        load_fn.release.set()
+
+        loader.load('b.mp3', new_plan)
+        finished = poll_until(loader)
+        self.assertEqual(finished, [('b.mp3', {'plan': new_plan, 'signals': {}})])
+
+    def test_prefetch_never_generates(self):
+        """A prefetch of a track that isn't cached isn't parked, and playing
+        the track mid prefetch generates it in a job of its own."""
+        load_fn = BlockingLoad()
+        loader = TrackLoader(load_fn)
+        plan = {'v': 1}
+
+        loader.prefetch(['c.mp3'], plan)
+        self.assertTrue(load_fn.started.wait(5))
+        loader.load('c.mp3', plan)
+        load_fn.release.set()
+
+        finished = poll_until(loader)
+        self.assertEqual(finished, [('c.mp3', {'plan': plan, 'signals': {}})])
+        self.assertEqual(load_fn.calls, [('c.mp3', plan, False), ('c.mp3', plan, True)])
+        self.assertNotIn('c.mp3', loader.prefetched)
+
+    def test_cancel_then_request_again(self):
+        """A load cancelled before it started doesn't linger, so the track
+        can be prefetched again and nothing is left running at the end."""
+        load_fn = BlockingLoad(cached=['b.mp3'])
+        loader = TrackLoader(load_fn)
+        plan = {'v': 1}
+
+        loader.load('a.mp3', plan)
+        self.assertTrue(load_fn.started.wait(5))
+        loader.load('b.mp3', plan)
+        loader.load('c.mp3', plan)
+        loader.prefetch(['b.mp3'], plan)
+        load_fn.release.set()
+
+        finished = poll_until(loader)
+        self.assertEqual(finished, [('c.mp3', {'plan': plan, 'signals': {}})])
+        deadline = time.time() + 5
+        while 'b.mp3' not in loader.prefetched and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertIn('b.mp3', loader.prefetched)
+        self.assertEqual(loader.active_jobs, {})
+
+    def test_prefetch_generate(self):
+        """Prefetches let to generate do, and playing the track mid prefetch
+        picks up that job rather than starting over."""
+        load_fn = BlockingLoad()
+        loader = TrackLoader(load_fn, prefetch_generate=True)
+        plan = {'v': 1}
+
+        loader.prefetch(['d.mp3'], plan)
+        self.assertTrue(load_fn.started.wait(5))
+        loader.load('d.mp3', plan)
+        load_fn.release.set()
+
+        finished = poll_until(loader)
+        self.assertEqual(finished, [('d.mp3', {'plan': plan, 'signals': {}})])
+        self.assertEqual(load_fn.calls, [('d.mp3', plan, True)])
+
+
+if __name__ == '__main__':
+    unittest.main()
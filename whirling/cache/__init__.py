@@ -0,0 +1,17 @@
+"""Initialize package."""
+
+import numpy as np
+
+
+def plan_output_nbytes(obj, resident_only: bool = False) -> int:
+    """Sum the size of all arrays in a plan output. Memory mapped arrays can
+    be left out since they're paged in from disk rather than held in RAM."""
+    if isinstance(obj, dict):
+        return sum(plan_output_nbytes(v, resident_only) for v in obj.values())
+    if isinstance(obj, (list, tuple)):
+        return sum(plan_output_nbytes(v, resident_only) for v in obj)
+    if isinstance(obj, np.ndarray):
+        if resident_only and isinstance(obj, np.memmap):
+            return 0
+        return obj.nbytes
+    return 0
@@ -0,0 +1,83 @@
+"""A cache of the individual arrays that make up a plan output.
+
+Where a dnz file holds everything one plan wants for a track, the artifact
+cache holds each separated signal, spectrogram and feature on its own. They're
+keyed by (audio hash, signal, artifact type, parameters) so any plan asking
+for the same thing reuses it, no matter which plan computed it first.
+
+Artifacts are laid out as:
+
+    <cache_dir>/artifacts/<audio hash>/<signal>/<kind>_<name>_<params hash>.npy
+"""
+
+import os
+import shutil
+import logging
+import numpy as np
+from whirling.cache import keys
+
+
+class ArtifactCache():
+    """Gets and puts the artifacts of a single track."""
+
+    def __init__(self, cache_dir: str, audio_hash: str):
+        self.root = os.path.join(cache_dir, 'artifacts', audio_hash)
+
+    def purge(self) -> None:
+        """Delete every artifact of the track, so it's all recomputed."""
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def file_name(self, signal: str, kind: str, name: str, params) -> str:
+        """Constructs the artifact file name."""
+        params_hash = keys.hash_params(params)
+        return os.path.join(self.root, signal, f'{kind}_{name}_{params_hash}.npy')
+
+    def get(self, signal: str, kind: str, name: str, params):
+        """Return the memory mapped artifact or None if it isn't cached.
+        Unreadable artifacts are deleted and treated as missing."""
+        file_name = self.file_name(signal, kind, name, params)
+        if not os.path.exists(file_name):
+            return None
+        try:
+            return np.load(file_name, mmap_mode='r')
+        except (ValueError, OSError) as e:
+            logging.warning('Dropping bad artifact %s: %s', file_name, e)
+            os.remove(file_name)
+            return None
+
+    def put(self, signal: str, kind: str, name: str, params, arr) -> None:
+        """Cache an artifact. It's written to a temp file then renamed so a
+        reader never sees a partial file."""
+        file_name = self.file_name(signal, kind, name, params)
+        os.makedirs(os.path.dirname(file_name), exist_ok=True)
+        tmp_name = f'{file_name}.{os.getpid()}.tmp'
+        with open(tmp_name, 'wb') as f:
+            np.save(f, np.asarray(arr))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_name, file_name)
+
+    def create(self, signal: str, kind: str, name: str, params, shape,
+               dtype=np.float32):
+        """Start an artifact too big to build in memory. Returns a writable
+        memory map of a temp file, call `commit` with it once it's filled."""
+        file_name = self.file_name(signal, kind, name, params)
+        os.makedirs(os.path.dirname(file_name), exist_ok=True)
+        tmp_name = f'{file_name}.{os.getpid()}.tmp'
+        return np.lib.format.open_memmap(tmp_name, mode='w+', dtype=dtype,
+                                         shape=shape)
+
+    def discard(self, arr) -> None:
+        """Delete the temp file of an artifact started with `create` that
+        won't be committed. Committed artifacts are left alone."""
+        if os.path.exists(arr.filename):
+            os.remove(arr.filename)
+
+    def commit(self, signal: str, kind: str, name: str, params, arr):
+        """Finish an artifact started with `create` and return it read only."""
+        file_name = self.file_name(signal, kind, name, params)
+        arr.flush()
+        with open(arr.filename, 'rb') as f:
+            os.fsync(f.fileno())
+        os.replace(arr.filename, file_name)
+        return self.get(signal, kind, name, params)
@@ -0,0 +1,242 @@
+"""The dnz (dance) file is the on disk format of a plan output.
+
+A dnz file is a small JSON header followed by raw array blocks:
+
+    | magic (4 bytes) | header length (uint32 LE) | JSON header | blocks ... |
+
+The JSON header holds the nested plan output dict with every numpy array
+swapped out for a reference into the `arrays` table. Each entry of that table
+describes a raw block by dtype, shape, offset and size. Blocks are aligned so
+they can be viewed straight out of a memory map. Loading a dnz file therefore
+only parses the header, array data gets paged in when a visualizer touches it.
+
+Arrays can also be stored at reduced precision by wrapping them in a
+`Quantized` before saving. Their table entry records how to get back to full
+precision and they're dequantized on load.
+
+The header carries a format version and the hash of the plan that made the
+file, and each block carries a checksum. Files are written to a temp file
+and renamed into place so a dnz file is either whole or missing.
+"""
+
+import os
+import json
+import zlib
+import struct
+import numpy as np
+
+
+MAGIC = b'\x93DNZ'
+ALIGNMENT = 64
+ARRAY_REF_KEY = '__dnz_array__'
+
+# Bump whenever the layout or the meaning of the header changes.
+FORMAT_VERSION = 2
+
+
+class DnzError(ValueError):
+    """Raised when a dnz file is corrupt or out of date."""
+
+
+class Quantized():
+    """An array to be stored at reduced precision.
+
+    Kinds:
+        float16: stored as half precision floats.
+        linear_uint8: clipped to [lo, hi] and stored as 256 evenly spaced
+            levels.
+    """
+
+    def __init__(self, arr, kind: str, lo: float = 0.0, hi: float = 1.0):
+        arr = np.asarray(arr)
+        self.spec = {'kind': kind, 'dtype': np.dtype(np.float32).str}
+        self.full_nbytes = arr.nbytes
+        if kind == 'float16':
+            self.stored = arr.astype(np.float16)
+        elif kind == 'linear_uint8':
+            self.spec.update({'lo': lo, 'hi': hi})
+            levels = (np.clip(arr, lo, hi) - lo) / (hi - lo) * 255
+            self.stored = np.round(levels).astype(np.uint8)
+        else:
+            raise ValueError(f'Unknown quantization {kind}.')
+
+
+def dequantize(arr, spec):
+    """Restore a quantized array to the precision its spec asks for."""
+    dtype = np.dtype(spec['dtype'])
+    if spec['kind'] == 'linear_uint8':
+        step = (spec['hi'] - spec['lo']) / 255
+        return (arr.astype(dtype) * dtype.type(step) + dtype.type(spec['lo']))
+    return arr.astype(dtype)
+
+
+###############################################################################
+# Helpers.
+###############################################################################
+
+def _aligned(offset: int) -> int:
+    """Round offset up to the next block alignment."""
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def _split_arrays(obj, arrays):
+    """Recursively replace arrays in obj with references into arrays."""
+    if isinstance(obj, dict):
+        return {str(k): _split_arrays(v, arrays) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_split_arrays(v, arrays) for v in obj]
+    if isinstance(obj, Quantized):
+        arrays.append((np.ascontiguousarray(obj.stored), obj.spec, obj.full_nbytes))
+        return {ARRAY_REF_KEY: len(arrays) - 1}
+    if isinstance(obj, (np.ndarray, np.generic)):
+        arr = np.asarray(obj)
+        if not arr.flags.c_contiguous:
+            arr = np.ascontiguousarray(arr)
+        if arr.dtype.hasobject:
+            raise ValueError('Object arrays can\'t be stored in a dnz file.')
+        arrays.append((arr, None, arr.nbytes))
+        return {ARRAY_REF_KEY: len(arrays) - 1}
+    return obj
+
+
+def _join_arrays(obj, arrays):
+    """Recursively swap array references in obj with the loaded arrays."""
+    if isinstance(obj, dict):
+        if ARRAY_REF_KEY in obj:
+            return arrays[obj[ARRAY_REF_KEY]]
+        return {k: _join_arrays(v, arrays) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [_join_arrays(v, arrays) for v in obj]
+    return obj
+
+
+def _checksum(arr) -> int:
+    """Checksum the raw bytes of an array."""
+    return zlib.crc32(arr.reshape(-1).view(np.uint8))
+
+
+def _encode_header(header, data_start: int) -> bytes:
+    """Encode header and pad it so the first block starts at data_start."""
+    encoded = json.dumps(header).encode('utf-8')
+    pad = data_start - len(MAGIC) - 4 - len(encoded)
+    return encoded + b' ' * pad
+
+
+###############################################################################
+# Saving and loading.
+###############################################################################
+
+def save_dnz(file_name: str, plan_output, plan_hash: str = None):
+    """Write a plan output to a dnz file. Returns the bytes of array data
+    written and what they would have taken at full precision."""
+    arrays = []
+    tree = _split_arrays(plan_output, arrays)
+
+    # The header size depends on the block offsets and the block offsets
+    # depend on the header size. Iterate until the offsets settle.
+    data_start = 0
+    while True:
+        table = []
+        offset = data_start
+        for arr, spec, _full_nbytes in arrays:
+            entry = {
+                'dtype': arr.dtype.str,
+                'shape': list(arr.shape),
+                'offset': offset,
+                'nbytes': arr.nbytes,
+                'checksum': _checksum(arr)
+            }
+            if spec is not None:
+                entry['quantization'] = spec
+            table.append(entry)
+            offset = _aligned(offset + arr.nbytes)
+        header = {
+            'format_version': FORMAT_VERSION,
+            'plan_hash': plan_hash,
+            'tree': tree,
+            'arrays': table
+        }
+        header_len = len(json.dumps(header).encode('utf-8'))
+        needed = _aligned(len(MAGIC) + 4 + header_len)
+        if needed <= data_start:
+            break
+        data_start = needed
+
+    encoded = _encode_header(header, data_start)
+    tmp_name = f'{file_name}.{os.getpid()}.tmp'
+    with open(tmp_name, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<I', len(encoded)))
+        f.write(encoded)
+        for (arr, _spec, _full_nbytes), entry in zip(arrays, table):
+            f.seek(entry['offset'])
+            f.write(arr.data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_name, file_name)
+
+    return {
+        'nbytes': sum(arr.nbytes for arr, _spec, _full_nbytes in arrays),
+        'full_nbytes': sum(full_nbytes for _arr, _spec, full_nbytes in arrays)
+    }
+
+
+def read_dnz_header(file_name: str, plan_hash: str = None):
+    """Read, parse and sanity check the JSON header of a dnz file. Checks
+    the magic, format version, plan hash when given and that the file is
+    long enough to hold every block. Raises DnzError if any check fails."""
+    with open(file_name, 'rb') as f:
+        magic = f.read(len(MAGIC))
+        if magic != MAGIC:
+            raise DnzError(f'{file_name} is not a dnz file.')
+        try:
+            header_len, = struct.unpack('<I', f.read(4))
+            header = json.loads(f.read(header_len).decode('utf-8'))
+        except (struct.error, UnicodeDecodeError, ValueError) as e:
+            raise DnzError(f'{file_name} has a corrupt header.') from e
+
+    if header.get('format_version') != FORMAT_VERSION:
+        raise DnzError(f'{file_name} is format version '
+                       f'{header.get("format_version")}, not {FORMAT_VERSION}.')
+    if plan_hash is not None and header['plan_hash'] != plan_hash:
+        raise DnzError(f'{file_name} was made by a different plan.')
+
+    data_end = max([e['offset'] + e['nbytes'] for e in header['arrays']], default=0)
+    if os.path.getsize(file_name) < data_end:
+        raise DnzError(f'{file_name} is truncated.')
+    return header
+
+
+def is_valid_dnz(file_name: str, plan_hash: str = None) -> bool:
+    """Cheaply check that a dnz file exists and its header is sound."""
+    if not os.path.exists(file_name):
+        return False
+    try:
+        read_dnz_header(file_name, plan_hash)
+    except DnzError:
+        return False
+    return True
+
+
+def load_dnz(file_name: str, plan_hash: str = None, verify: bool = False):
+    """Open a dnz file. Arrays are returned as read only views into a memory
+    map of the file so nothing is copied into RAM up front. Quantized arrays
+    are the exception, they're dequantized into memory.
+
+    Verifying checksums reads every block, so it's off by default. The atomic
+    writes already rule out partially written files."""
+    header = read_dnz_header(file_name, plan_hash)
+    raw = np.memmap(file_name, dtype=np.uint8, mode='r')
+
+    arrays = []
+    for entry in header['arrays']:
+        start = entry['offset']
+        block = raw[start: start + entry['nbytes']]
+        if verify and zlib.crc32(block) != entry['checksum']:
+            raise DnzError(f'{file_name} failed a checksum at offset {start}.')
+        arr = block.view(np.dtype(entry['dtype'])).reshape(entry['shape'])
+        if 'quantization' in entry:
+            arr = dequantize(arr, entry['quantization'])
+        arrays.append(arr)
+
+    return _join_arrays(header['tree'], arrays)
@@ -0,0 +1,138 @@
+"""Content addressed cache keys.
+
+A cache entry is named after what went into it rather than where the track
+lives or what the plan file is called:
+
+* The audio hash is a digest of the track file's bytes. Moved, renamed or
+  duplicated tracks hash the same.
+* The plan hash is a digest of the normalized plan metadata and the merged
+  signal definitions. Plans that request the same data share entries and
+  changes like a new `hop_length` land in a new entry.
+"""
+
+import os
+import json
+import fcntl
+import atexit
+import hashlib
+import logging
+import threading
+
+
+DIGEST_SIZE = 16
+READ_CHUNK_SIZE = 1 << 20
+
+
+def _digest(data: bytes) -> str:
+    return hashlib.blake2b(data, digest_size=DIGEST_SIZE).hexdigest()
+
+
+def hash_file(file_name: str) -> str:
+    """Hash the raw bytes of a file."""
+    h = hashlib.blake2b(digest_size=DIGEST_SIZE)
+    with open(file_name, 'rb') as f:
+        for chunk in iter(lambda: f.read(READ_CHUNK_SIZE), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def hash_params(params) -> str:
+    """Hash a json serializable blob. Keys are sorted so the hash only
+    depends on content and not on how the blob was written."""
+    normalized = json.dumps(params, sort_keys=True, separators=(',', ':'))
+    return _digest(normalized.encode('utf-8'))
+
+
+def plan_hash(metadata, merged_signal_defs) -> str:
+    """Hash the parts of a plan that affect generated data. Visualizer
+    settings only matter at render time so they are left out."""
+    return hash_params({
+        'metadata': metadata,
+        'signals': merged_signal_defs['signals']
+    })
+
+
+class AudioHashIndex():
+    """Remembers audio hashes by file path, size and modification time so
+    a track's bytes are only read again after the file changes.
+
+    New hashes are written out in batches and at exit. Every process using
+    the cache shares the index, so a save merges into whatever is on disk
+    rather than overwriting it."""
+
+    INDEX_NAME = 'audio_hashes.json'
+
+    # New hashes held before the index is saved.
+    SAVE_EVERY = 64
+
+    def __init__(self, cache_dir: str):
+        self.index_name = os.path.join(cache_dir, self.INDEX_NAME)
+        self.lock = threading.Lock()
+        self.index = self.read()
+        self.unsaved = {}
+        atexit.register(self.flush)
+
+    def read(self):
+        """Read the index on disk."""
+        if not os.path.exists(self.index_name):
+            return {}
+        try:
+            with open(self.index_name, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except ValueError:
+            logging.warning('Ignoring corrupt audio hash index %s.', self.index_name)
+            return {}
+
+    def known_hash(self, track_name: str) -> str:
+        """Get the audio hash of a track if the file hasn't changed since it
+        was last hashed, otherwise None. Never reads the track."""
+        stat = os.stat(track_name)
+        entry = self.index.get(os.path.abspath(track_name))
+        if entry and entry['size'] == stat.st_size and \
+                entry['mtime_ns'] == stat.st_mtime_ns:
+            return entry['hash']
+        return None
+
+    def audio_hash(self, track_name: str) -> str:
+        """Get the audio hash of a track, hashing it if needed."""
+        digest = self.known_hash(track_name)
+        if digest is not None:
+            return digest
+
+        stat = os.stat(track_name)
+        path = os.path.abspath(track_name)
+        digest = hash_file(track_name)
+        with self.lock:
+            entry = {
+                'size': stat.st_size,
+                'mtime_ns': stat.st_mtime_ns,
+                'hash': digest
+            }
+            self.index[path] = entry
+            self.unsaved[path] = entry
+            if len(self.unsaved) >= self.SAVE_EVERY:
+                self.save()
+        return digest
+
+    def flush(self):
+        """Save hashes that haven't been yet."""
+        with self.lock:
+            if self.unsaved:
+                self.save()
+
+    def save(self):
+        """Merge the new hashes into the index on disk. The lock file keeps
+        processes from dropping each other's hashes and renaming a temp file
+        keeps them from ever reading a half written index. Must be called
+        with the lock held."""
+        os.makedirs(os.path.dirname(self.index_name), exist_ok=True)
+        with open(f'{self.index_name}.lock', 'w', encoding='utf-8') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            index = self.read()
+            index.update(self.unsaved)
+            tmp_name = f'{self.index_name}.{os.getpid()}.{threading.get_ident()}.tmp'
+            with open(tmp_name, 'w', encoding='utf-8') as f:
+                json.dump(index, f)
+            os.replace(tmp_name, self.index_name)
+        self.index.update(index)
+        self.unsaved = {}
@@ -0,0 +1,67 @@
+"""An in memory least recently used cache of plan outputs.
+
+Entries are bounded by the total bytes of their arrays rather than by count
+since one plan output can be a hundred times the size of another.
+"""
+
+import logging
+import threading
+from collections import OrderedDict
+from whirling.cache import plan_output_nbytes
+
+
+DEFAULT_LRU_BUDGET = 2 << 30
+
+
+class PlanOutputLRU():
+    """Holds recently used plan outputs within a byte budget."""
+
+    def __init__(self, budget: int = DEFAULT_LRU_BUDGET):
+        self.budget = budget
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.lock = threading.Lock()
+
+        # Counters.
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """Return the plan output for key or None, marking it recently used."""
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key][0]
+
+    def put(self, key, plan_output) -> None:
+        """Add a plan output, evicting least recently used entries to make
+        room. Plan outputs bigger than the whole budget aren't kept."""
+        nbytes = plan_output_nbytes(plan_output)
+        with self.lock:
+            if key in self.entries:
+                self.nbytes -= self.entries.pop(key)[1]
+            if nbytes > self.budget:
+                logging.info('Plan output %s is over the LRU budget.', key)
+                return
+
+            self.entries[key] = (plan_output, nbytes)
+            self.nbytes += nbytes
+            while self.nbytes > self.budget:
+                _key, (_plan_output, evicted_nbytes) = self.entries.popitem(last=False)
+                self.nbytes -= evicted_nbytes
+                self.evictions += 1
+
+    def stats(self):
+        """Return the cache counters."""
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self.entries),
+                'nbytes': self.nbytes
+            }
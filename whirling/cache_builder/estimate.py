@@ -0,0 +1,174 @@
+"""Estimate what building a plan over a track library will cost.
+
+Only file headers are read, for durations. CPU time comes from a cost per
+second of audio for every step the plan's merged signal definitions call for:
+one run of each separator, plus each spectrogram and feature of each signal.
+Costs are calibrated from the timing reports of earlier builds in
+`<cache_dir>/timings.jsonl`. Steps that have never been timed fall back to
+rough defaults. Peak memory comes from the memory model. Disk use follows
+from the shapes the plan's metadata implies.
+"""
+
+import logging
+from whirling.store import Store, step_kind
+from whirling.signal_transformers.signal_dissectors import SEPARATORS, needs_samples
+from whirling.signal_transformers import stft_signal
+from whirling.signal_transformers import spectrogram_variants
+from whirling.signal_transformers import audio_features
+from whirling.cache_builder.timing import read_timings
+
+
+# CPU seconds per second of audio by step, until there are timing reports.
+# Separators declare their own.
+DEFAULT_STEP_COSTS = {
+    'stft/standard': 0.01,
+    'spectrograms/custom_log_db': 0.2,
+    'features/beats': 0.05,
+    'features/onsets': 0.03,
+    'write/dnz': 0.005
+}
+DEFAULT_STEP_COST = 0.02
+
+
+def plan_steps(merged_signal_defs):
+    """The steps a plan runs per track as 'stage/kind' names. Separators are
+    listed once however many of their signals are used."""
+    steps = []
+    for sig_name, s_obj in merged_signal_defs['signals'].items():
+        keys = [('signal', sig_name)]
+        keys += [('spectrograms', sig_name, s) for s in s_obj.get('spectrograms', {})]
+        keys += [('features', sig_name, f) for f in s_obj.get('features', {})]
+        for key in keys:
+            step = f'{Store.step_stage(key)}/{step_kind(key)}'
+            if key[0] != 'signal' or step not in steps:
+                steps.append(step)
+    if 'decode/full' not in steps:
+        steps.append('decode/full')
+    steps.append('write/dnz')
+    return steps
+
+
+class CostModel():
+    """CPU seconds per second of audio for each kind of build step."""
+
+    def __init__(self, cache_dir: str):
+        self.costs = dict(DEFAULT_STEP_COSTS)
+        for name, separator in SEPARATORS.items():
+            key = ('signal', separator['signals'][0])
+            self.costs[f'{Store.step_stage(key)}/{name}'] = separator['cost']
+        self.calibrated = set()
+        self.calibrate(read_timings(cache_dir))
+
+    def calibrate(self, records):
+        """Take the median cost of each step over the timing records. Tracks
+        that reused cached artifacts run fast, the median keeps them from
+        dragging the cost down much."""
+        samples = {}
+        for record in records:
+            if record.get('duration', 0) <= 0:
+                continue
+            for stage, profile in record['stages'].items():
+                if stage == 'write':
+                    samples.setdefault('write/dnz', []).append(
+                        profile['seconds'] / record['duration'])
+                    continue
+                counts = profile.get('counts', {})
+                for kind, seconds in profile.get('steps', {}).items():
+                    count = counts.get(kind, 1)
+                    samples.setdefault(f'{stage}/{kind}', []).append(
+                        seconds / count / record['duration'])
+        for step, rates in samples.items():
+            rates.sort()
+            self.costs[step] = rates[len(rates) // 2]
+            self.calibrated.add(step)
+
+    def cost(self, step: str) -> float:
+        """CPU seconds per second of audio for a step."""
+        return self.costs.get(step, DEFAULT_STEP_COST)
+
+
+def disk_bytes_per_second(plan, merged_signal_defs):
+    """Bytes per second of audio for the dnz file and the artifact cache."""
+    metadata = plan['metadata']
+    sr = metadata['sr']
+    frames = sr / metadata['hop_length']
+    reduced = metadata.get('storage_precision', 'full') == 'reduced'
+    save_signals = metadata.get('save_signals', True)
+    n_bands = len(spectrogram_variants.log_db_bands(metadata['n_fft'] // 2 + 1))
+
+    dnz_bytes = 0.0
+    artifact_bytes = 0.0
+    cached_signals = 1
+    for sig_name, s_obj in merged_signal_defs['signals'].items():
+        if save_signals:
+            dnz_bytes += sr * 4
+        # HPSS signals only get cached when they're synthesized.
+        if sig_name != 'full' and (not stft_signal(sig_name) or
+                                   needs_samples(metadata, s_obj.get('features', {}))):
+            cached_signals += 1
+        if s_obj.get('spectrograms', {}).get('custom_log_db'):
+            dnz_bytes += frames * n_bands * (1 if reduced else 8)
+            artifact_bytes += frames * n_bands * 8
+        for f in s_obj.get('features', {}):
+            # Beats and onsets are a handful of frame numbers.
+            if f in ['beats', 'onsets']:
+                continue
+            normalized = audio_features.function_listing(f)['normalized']
+            dnz_bytes += frames * (2 if reduced and normalized else 8)
+            artifact_bytes += frames * 8
+
+    # Every signal cached, the full signal included.
+    artifact_bytes += cached_signals * sr * 4
+    return dnz_bytes, artifact_bytes
+
+
+def estimate_build(tracks, plan, merged_signal_defs, cost_model, memory_model,
+                   jobs: int = 1):
+    """Estimate a build of tracks. Tracks whose duration can't be read are
+    left out and listed."""
+    durations = {}
+    unreadable = []
+    for track in tracks:
+        try:
+            durations[track] = memory_model.duration(track)
+        except Exception as e:  # pylint: disable=broad-except
+            logging.warning('Can\'t read the duration of %s: %s', track, e)
+            unreadable.append(track)
+
+    steps = plan_steps(merged_signal_defs)
+    audio_seconds = sum(durations.values())
+    step_seconds = {step: cost_model.cost(step) * audio_seconds for step in steps}
+    dnz_bytes, artifact_bytes = disk_bytes_per_second(plan, merged_signal_defs)
+    cpu_seconds = sum(step_seconds.values())
+    return {
+        'tracks': len(durations),
+        'unreadable': unreadable,
+        'audio_seconds': audio_seconds,
+        'cpu_seconds': cpu_seconds,
+        'wall_seconds': cpu_seconds / max(1, min(jobs, len(durations) or 1)),
+        'step_seconds': step_seconds,
+        'uncalibrated': [s for s in steps if s not in cost_model.calibrated],
+        'peak_memory_mb': max([memory_model.estimate_mb(t) for t in durations],
+                              default=0),
+        'dnz_bytes': dnz_bytes * audio_seconds,
+        'artifact_bytes': artifact_bytes * audio_seconds
+    }
+
+
+def print_estimate(estimate) -> None:
+    """Print an estimate for people to read."""
+    print(f'Tracks:          {estimate["tracks"]} '
+          f'({estimate["audio_seconds"] / 3600:.1f} hours of audio)')
+    print(f'CPU time:        {estimate["cpu_seconds"] / 3600:.2f} hours')
+    print(f'Wall time:       {estimate["wall_seconds"] / 3600:.2f} hours')
+    print(f'Peak memory:     {estimate["peak_memory_mb"]:.0f} MB per worker')
+    print(f'dnz files:       {estimate["dnz_bytes"] / 1e9:.2f} GB')
+    print(f'Artifact cache:  {estimate["artifact_bytes"] / 1e9:.2f} GB')
+    print('CPU time by step:')
+    for step, seconds in sorted(estimate['step_seconds'].items(),
+                                key=lambda item: -item[1]):
+        print(f'  {step:<32} {seconds / 3600:8.2f} hours')
+    if estimate['uncalibrated']:
+        print('Not yet timed, using defaults: ' + ', '.join(estimate['uncalibrated']))
+    if estimate['unreadable']:
+        print(f'Left out {len(estimate["unreadable"])} tracks with unreadable durations.')
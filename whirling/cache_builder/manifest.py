@@ -0,0 +1,105 @@
+"""A record of how far along every track is in a cache build.
+
+The manifest is a JSON-lines log in `<cache_dir>/manifest.jsonl`. Workers
+append a line whenever a build stage of a track starts, finishes or fails:
+
+    {"track": ..., "plan_hash": ..., "stage": "separate", "state": "done", ...}
+
+Lines with no stage are about the whole track. The pool writes one when it
+hands a track to a worker, which starts the track over, and one if the track
+fails. Replaying the log gives the state of every (track, plan) pair, so
+progress can be read back without touching the tracks or recomputing
+anything. Appending lets every worker process write to the same file without
+coordination.
+
+The manifest only records progress. The checkpoints themselves are the
+artifact cache. Every decoded signal, separated stem, spectrogram variant and
+feature lands there as soon as it's made, so a restarted build skips
+straight past the stages a track already finished.
+"""
+
+import os
+import json
+import time
+from whirling.store import BUILD_STAGES
+
+
+MANIFEST_NAME = 'manifest.jsonl'
+
+
+class Manifest():
+    """Reads and appends to the manifest of a cache dir."""
+
+    def __init__(self, cache_dir: str):
+        self.manifest_name = os.path.join(cache_dir, MANIFEST_NAME)
+
+    def mark(self, track_name: str, plan_hash: str, stage: str, state: str,
+             detail=None) -> None:
+        """Record a stage of a track changing state. A stage of None is the
+        track as a whole."""
+        entry = {
+            'track': track_name,
+            'plan_hash': plan_hash,
+            'stage': stage,
+            'state': state,
+            'time': time.time(),
+            'pid': os.getpid()
+        }
+        if detail is not None:
+            entry['detail'] = detail
+        os.makedirs(os.path.dirname(self.manifest_name), exist_ok=True)
+        with open(self.manifest_name, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry) + '\n')
+
+    def listener(self, plan_hash: str):
+        """A store stage listener that records stages under a plan."""
+        def on_stage(track_name, stage, state, detail=None):
+            self.mark(track_name, plan_hash, stage, state, detail)
+        return on_stage
+
+    def states(self, plan_hash: str):
+        """Replay the log into the latest state of each track under a plan.
+        Returns {track: {'stages': {stage: state}, 'error': str or None}}.
+        A failed track has the stages that were running marked failed."""
+        tracks = {}
+        if not os.path.exists(self.manifest_name):
+            return tracks
+        with open(self.manifest_name, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if entry.get('plan_hash') != plan_hash:
+                    continue
+                stage, state = entry['stage'], entry['state']
+                if stage is None and state == 'started':
+                    tracks[entry['track']] = {'stages': {}, 'error': None}
+                    continue
+                track = tracks.setdefault(entry['track'], {'stages': {}, 'error': None})
+                if stage is not None:
+                    track['stages'][stage] = state
+                elif state == 'failed':
+                    track['error'] = entry.get('detail')
+                    for s, s_state in track['stages'].items():
+                        if s_state == 'started':
+                            track['stages'][s] = 'failed'
+        return tracks
+
+
+def track_status(track_state) -> str:
+    """Summarize a track's state as one short line."""
+    if track_state is None:
+        return 'pending'
+    stages = track_state['stages']
+    if stages.get('write') == 'done':
+        return 'done'
+    if track_state['error'] is not None:
+        failed = [s for s in BUILD_STAGES if stages.get(s) == 'failed']
+        if not failed:
+            return f'failed: {track_state["error"]}'
+        return f'failed in {", ".join(failed)}: {track_state["error"]}'
+    finished = [s for s in BUILD_STAGES if stages.get(s) in ('done', 'skipped')]
+    if not finished:
+        return 'started'
+    return f'incomplete, finished {", ".join(finished)}'
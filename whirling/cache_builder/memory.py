@@ -0,0 +1,134 @@
+"""Estimates how much memory generating a track takes.
+
+Separating a long track with Spleeter and HPSS can take several GB, so the
+worker pool only starts a track once its estimate fits in the memory budget
+next to everything already running. An estimate is a worker's baseline, the
+Python process with its models loaded, plus a fixed overhead per track and a
+cost per second of audio for each family of signal the plan asks for.
+
+The per second costs start out as rough defaults. Every finished track
+records its measured peak in `<cache_dir>/memory_profile.jsonl` and estimates
+for the same signal families are refit to those measurements. A worker's
+first track also pays for the libraries and models it loads once, which has
+nothing to do with the track's duration, so first tracks are left out of the
+fit once there are others.
+"""
+
+import os
+import json
+import logging
+import librosa
+from whirling.signal_transformers.signal_dissectors import SEPARATORS, separator_of
+
+
+PROFILE_NAME = 'memory_profile.jsonl'
+
+# Worker memory with its models loaded and no track in flight.
+DEFAULT_BASELINE_MB = 1536
+
+# Measurements are padded by this much so estimates err on the high side.
+SAFETY_MARGIN = 1.2
+
+
+def track_duration(track_name: str) -> float:
+    """Duration of a track in seconds. Only the file header is read when the
+    format allows it."""
+    return librosa.get_duration(filename=track_name)
+
+
+###############################################################################
+# Estimates.
+###############################################################################
+
+class MemoryModel():
+    """Estimates peak worker memory for tracks under one plan."""
+
+    def __init__(self, cache_dir: str, signal_names):
+        self.profile_name = os.path.join(cache_dir, PROFILE_NAME)
+        self.families = sorted(set(separator_of(s) for s in signal_names))
+        self.durations = {}
+
+        self.baseline_mb = DEFAULT_BASELINE_MB
+        self.overhead_mb = 0.0
+        self.default_mb_per_second = sum(SEPARATORS[f]['memory_mb'] for f in self.families)
+        self.mb_per_second = self.default_mb_per_second
+        self.records = self.load_profile()
+        self.fit(self.records)
+
+    def duration(self, track_name: str) -> float:
+        """Duration of a track, remembered after the first read."""
+        if track_name not in self.durations:
+            self.durations[track_name] = track_duration(track_name)
+        return self.durations[track_name]
+
+    def estimate_mb(self, track_name: str) -> float:
+        """Estimated peak memory of a worker processing this track."""
+        return self.baseline_mb + self.overhead_mb + \
+            self.duration(track_name) * self.mb_per_second
+
+    def load_profile(self):
+        """Read the measurements made under the same signal families."""
+        records = []
+        if not os.path.exists(self.profile_name):
+            return records
+        with open(self.profile_name, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if record.get('families') == self.families:
+                    records.append(record)
+        return records
+
+    def fit(self, records):
+        """Fit the baseline, overhead and per second cost to measurements. The
+        per second cost is a least squares fit of growth on duration, the
+        default until durations differ. The overhead is then the most any
+        track grew past that, since underestimating is what gets workers
+        killed."""
+        records = [r for r in records if r['duration'] > 0]
+        if not all(r.get('first') for r in records):
+            records = [r for r in records if not r.get('first')]
+        if not records:
+            return
+        starts = sorted(r['start_mb'] for r in records)
+        self.baseline_mb = starts[len(starts) // 2]
+
+        durations = [r['duration'] for r in records]
+        growths = [r['peak_mb'] - r['start_mb'] for r in records]
+        mean_duration = sum(durations) / len(durations)
+        mean_growth = sum(growths) / len(growths)
+        spread = sum((d - mean_duration) ** 2 for d in durations)
+        if spread > 0:
+            slope = sum((d - mean_duration) * (g - mean_growth)
+                        for d, g in zip(durations, growths)) / spread
+            slope = max(slope, 0.0)
+        else:
+            slope = self.default_mb_per_second / SAFETY_MARGIN
+        overhead = max(g - slope * d for d, g in zip(durations, growths))
+
+        self.mb_per_second = SAFETY_MARGIN * slope
+        self.overhead_mb = SAFETY_MARGIN * max(overhead, 0.0)
+
+    def record(self, track_name: str, start_mb: float, peak_mb: float,
+               first: bool = False) -> None:
+        """Record a measured peak so later runs estimate better. First is
+        whether it was the first track of its worker."""
+        record = {
+            'track': track_name,
+            'families': self.families,
+            'duration': self.duration(track_name),
+            'start_mb': start_mb,
+            'peak_mb': peak_mb,
+            'first': first
+        }
+        logging.info('Track %s peaked at %.0f MB, estimated %.0f MB.',
+                     track_name, peak_mb, self.estimate_mb(track_name))
+        os.makedirs(os.path.dirname(self.profile_name), exist_ok=True)
+        with open(self.profile_name, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record) + '\n')
+
+        # Tracks later in this run benefit too.
+        self.records.append(record)
+        self.fit(self.records)
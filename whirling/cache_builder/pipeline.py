@@ -0,0 +1,107 @@
+"""Overlap the stages of generating different tracks.
+
+Building one track is strictly sequential: decode, separate, then the stft,
+spectrograms and features. Each of those leans on something different, the
+decoder on disk and the resampler, Spleeter on TensorFlow's thread pool and
+the analysis on numpy. A pipelined worker gives every group of stages its own
+thread, connected by bounded queues, so while track N is being separated
+track N+1 decodes and track N-1 gets analyzed. Throughput is then set by the
+slowest group instead of the sum of them.
+
+Builds in a pipeline lay their steps out by stage rather than by signal, so
+separated signals stay in memory until analysis instead of being released
+signal by signal.
+"""
+
+import queue
+import logging
+import threading
+from whirling.cache_builder.track_logs import track_logging
+
+
+# Groups of build stages that run on their own thread, in order. Writing the
+# dnz file happens at the end of the last group.
+PIPELINE_GROUPS = [
+    ('decode', ['decode']),
+    ('separate', ['separate']),
+    ('analyze', ['stft', 'spectrograms', 'features'])
+]
+PIPELINE_STAGE_ORDER = [s for _name, stages in PIPELINE_GROUPS for s in stages]
+
+# Builds waiting between groups. More just holds more signals in memory.
+QUEUE_SIZE = 1
+
+
+class PipelineItem():
+    """A track passing through the pipeline."""
+
+    def __init__(self, track_name: str):
+        self.track_name = track_name
+        self.build = None
+        self.error = None
+
+
+class StagePipeline():
+    """Runs tracks through the stage groups, each on its own thread."""
+
+    def __init__(self, store, queue_size: int = QUEUE_SIZE, log_dir: str = None):
+        self.store = store
+        self.queue_size = queue_size
+        self.log_dir = log_dir
+
+    def run(self, next_track, on_result) -> None:
+        """Pull tracks from next_track until it returns None, calling
+        on_result(track, error) as each one makes it out the other end. Error
+        is None for tracks that built fine. Blocks until the pipeline drains."""
+        queues = [queue.Queue(self.queue_size) for _group in PIPELINE_GROUPS[1:]]
+        threads = []
+        for i, (name, stages) in enumerate(PIPELINE_GROUPS):
+            in_queue = queues[i - 1] if i > 0 else None
+            out_queue = queues[i] if i < len(queues) else None
+            threads.append(threading.Thread(
+                target=self.run_group, name=f'pipeline_{name}',
+                args=(stages, next_track, in_queue, out_queue, on_result)))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def run_group(self, stages, next_track, in_queue, out_queue, on_result):
+        """Thread loop of one stage group. The first group pulls new tracks,
+        the last one writes them out. None passes down the line to stop it."""
+        while True:
+            if in_queue is None:
+                track_name = next_track()
+                item = PipelineItem(track_name) if track_name is not None else None
+            else:
+                item = in_queue.get()
+            if item is None:
+                if out_queue is not None:
+                    out_queue.put(None)
+                return
+
+            if item.error is None:
+                with track_logging(self.log_dir, item.track_name):
+                    try:
+                        self.run_stages(item, stages, out_queue is None)
+                    except Exception as e:  # pylint: disable=broad-except
+                        logging.exception('Failed processing track: %s', item.track_name)
+                        item.error = repr(e)
+                        item.build = None
+
+            if out_queue is not None:
+                out_queue.put(item)
+            else:
+                on_result(item.track_name, item.error)
+
+    def run_stages(self, item, stages, is_last):
+        """Run the stages of one group on a track."""
+        if item.build is None:
+            logging.info('Processing track: %s', item.track_name)
+            item.build = self.store.prepare_build(
+                item.track_name, stage_order=PIPELINE_STAGE_ORDER)
+        self.store.run_build_steps(item.build, stages)
+        if is_last:
+            plan_output = self.store.finish_build(item.build)
+            self.store.write_plan_output(item.track_name, plan_output)
+            item.build = None
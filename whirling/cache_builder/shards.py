@@ -0,0 +1,143 @@
+"""Split a cache build between machines.
+
+Every host building caches into a shared cache dir runs with the same
+`--shard-count` and its own `--shard-index`. Each host partitions the full
+track list the same way and builds only its own shard. Shards are balanced
+by audio duration rather than by track count, since a build's run time
+follows duration.
+
+Lock files next to the dnz files back the partition up. A host only builds
+a track after creating its lock, so two hosts never build the same track,
+even with mismatched shard options. Locks name their owner and are refreshed
+while the track builds. A lock whose owner died goes stale and can be taken
+over. Taking one over renames it out of the way first, so of two hosts that
+both find it stale only one gets to break it.
+"""
+
+import os
+import json
+import time
+import socket
+import logging
+
+
+# Seconds between lock refreshes, and how old a lock gets before it's stale.
+LOCK_REFRESH_INTERVAL = 60
+LOCK_STALE_AFTER = 600
+
+
+def partition(tracks, shard_count: int, cost_fn):
+    """Deal tracks out to shard_count shards, the costliest first to the
+    cheapest shard so far. Ties are broken by name so every host comes up
+    with the same shards."""
+    shards = [[] for _ in range(shard_count)]
+    totals = [0.0] * shard_count
+    for track in sorted(tracks, key=lambda t: (-cost_fn(t), t)):
+        i = min(range(shard_count), key=lambda s: (totals[s], s))
+        shards[i].append(track)
+        totals[i] += cost_fn(track)
+    return shards
+
+
+def shard_tracks(tracks, shard_index: int, shard_count: int, cost_fn):
+    """The tracks in one shard, in their original order."""
+    if shard_count == 1:
+        return list(tracks)
+    shard = set(partition(tracks, shard_count, cost_fn)[shard_index])
+    return [t for t in tracks if t in shard]
+
+
+class TrackLocks():
+    """Lock files that keep hosts sharing a cache dir off each other's
+    tracks."""
+
+    def __init__(self, stale_after: float = LOCK_STALE_AFTER):
+        self.stale_after = stale_after
+        self.held = set()
+        self.last_refresh = time.time()
+
+    def acquire(self, lock_name: str) -> bool:
+        """Try to create a lock. Stale locks are broken."""
+        # Nothing may have been cached with this plan yet.
+        os.makedirs(os.path.dirname(lock_name) or '.', exist_ok=True)
+        for _attempt in range(2):
+            try:
+                fd = os.open(lock_name, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                try:
+                    inode = os.stat(lock_name).st_ino
+                except FileNotFoundError:
+                    continue
+                if not self.is_stale(lock_name):
+                    return False
+                self.break_lock(lock_name, inode)
+                continue
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump({'host': socket.gethostname(), 'pid': os.getpid()}, f)
+            self.held.add(lock_name)
+            return True
+        return False
+
+    def break_lock(self, lock_name: str, inode: int) -> None:
+        """Break a lock found stale. It's renamed to a name only this process
+        uses, which only one host can do. If what got renamed isn't the lock
+        that was found stale, another host broke that one and made a fresh
+        lock in the meantime, so it's put back."""
+        broken_name = f'{lock_name}.{socket.gethostname()}.{os.getpid()}.broken'
+        try:
+            os.rename(lock_name, broken_name)
+        except FileNotFoundError:
+            return
+        if os.stat(broken_name).st_ino == inode:
+            logging.warning('Breaking stale lock %s.', lock_name)
+        else:
+            try:
+                os.link(broken_name, lock_name)
+            except FileExistsError:
+                pass
+        os.remove(broken_name)
+
+    def release(self, lock_name: str) -> None:
+        """Remove a lock this process holds."""
+        if lock_name not in self.held:
+            return
+        self.held.discard(lock_name)
+        try:
+            os.remove(lock_name)
+        except FileNotFoundError:
+            pass
+
+    def refresh(self) -> None:
+        """Touch held locks so other hosts know they're still being worked
+        on. Cheap enough to call every loop, it only touches them once per
+        LOCK_REFRESH_INTERVAL."""
+        if time.time() - self.last_refresh < LOCK_REFRESH_INTERVAL:
+            return
+        self.last_refresh = time.time()
+        for lock_name in self.held:
+            try:
+                os.utime(lock_name)
+            except FileNotFoundError:
+                logging.warning('Lock %s went missing.', lock_name)
+
+    def is_stale(self, lock_name: str) -> bool:
+        """A lock is stale once its owner is known to be dead or it hasn't
+        been refreshed in stale_after seconds."""
+        try:
+            age = time.time() - os.path.getmtime(lock_name)
+            with open(lock_name, 'r', encoding='utf-8') as f:
+                owner = json.load(f)
+        except FileNotFoundError:
+            return True
+        except ValueError:
+            # Its owner may still be writing it.
+            return age > self.stale_after
+
+        if owner.get('host') == socket.gethostname():
+            try:
+                os.kill(owner['pid'], 0)
+            except ProcessLookupError:
+                return True
+            except PermissionError:
+                pass
+        return age > self.stale_after
@@ -0,0 +1,123 @@
+"""Where the time in a cache build goes.
+
+The store times every build step and measures the process's peak memory
+around it. It hands the totals to the stage listener as each stage finishes.
+Workers collect them per track. The pool appends one record per finished
+track to `<cache_dir>/timings.jsonl`:
+
+    {"track": ..., "duration": 212.4, "seconds": 95.1, "peak_rss_mb": 4120.5,
+     "stages": {"separate": {"seconds": 61.0, "peak_rss_mb": 4120.5,
+                             "steps": {"spleeter": 48.2, "librosa": 12.8}},
+                ...}}
+
+It's a handful of perf_counter calls per step, cheap enough to leave on for
+every build. Measuring a stage's peak means resetting the process's peak,
+which pipelined workers can't do with stages of other tracks running on other
+threads. Their stages go without peaks and each track only gets the process's
+peak so far, which covers whatever else was running at the same time.
+"""
+
+import os
+import json
+import time
+import logging
+
+
+TIMINGS_NAME = 'timings.jsonl'
+
+
+def read_timings(cache_dir: str):
+    """Read every timing record in a cache dir. Unreadable lines, like one
+    cut off by a crash, are skipped."""
+    report_name = os.path.join(cache_dir, TIMINGS_NAME)
+    records = []
+    if not os.path.exists(report_name):
+        return records
+    with open(report_name, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue
+    return records
+
+
+class StageProfiler():
+    """A stage listener that collects a worker's stage profiles per track.
+    Events are passed on to the listener it wraps."""
+
+    def __init__(self, listener=None):
+        self.listener = listener
+        self.profiles = {}
+
+    def on_stage(self, track_name, stage, state, detail=None):
+        """Keep the profile of every stage that finishes."""
+        if state == 'done' and detail is not None:
+            self.profiles.setdefault(track_name, {})[stage] = detail
+        if self.listener is not None:
+            self.listener(track_name, stage, state, detail)
+
+    def pop(self, track_name):
+        """Take the stage profiles of a track."""
+        return self.profiles.pop(track_name, {})
+
+
+class TimingReport():
+    """Writes per track timing records and sums them up at the end."""
+
+    def __init__(self, cache_dir: str, duration_fn):
+        self.report_name = os.path.join(cache_dir, TIMINGS_NAME)
+        self.duration_fn = duration_fn
+        self.start = time.time()
+        self.tracks = 0
+        self.audio_seconds = 0.0
+        self.stage_seconds = {}
+        self.step_seconds = {}
+
+    def record(self, track_name: str, seconds: float, stages,
+               peak_rss_mb: float = None) -> None:
+        """Append a finished track's record and add it to the totals."""
+        duration = self.duration_fn(track_name)
+        record = {
+            'track': track_name,
+            'time': time.time(),
+            'duration': duration,
+            'seconds': seconds,
+            'stages': stages
+        }
+        if peak_rss_mb is not None:
+            record['peak_rss_mb'] = peak_rss_mb
+        os.makedirs(os.path.dirname(self.report_name), exist_ok=True)
+        with open(self.report_name, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record) + '\n')
+
+        self.tracks += 1
+        self.audio_seconds += duration
+        for stage, profile in stages.items():
+            self.stage_seconds[stage] = self.stage_seconds.get(stage, 0.0) + \
+                profile['seconds']
+            for kind, step_seconds in profile.get('steps', {}).items():
+                name = f'{stage}/{kind}'
+                self.step_seconds[name] = self.step_seconds.get(name, 0.0) + step_seconds
+
+    def log_summary(self) -> None:
+        """Log throughput and where the time went."""
+        wall = time.time() - self.start
+        if self.tracks == 0 or wall <= 0:
+            return
+        logging.info('Built %d tracks in %.0f s: %.1f tracks/hour, %.2f seconds'
+                     ' of audio per second.', self.tracks, wall,
+                     self.tracks / wall * 3600, self.audio_seconds / wall)
+
+        total = sum(self.stage_seconds.values())
+        for stage, seconds in sorted(self.stage_seconds.items(),
+                                     key=lambda item: -item[1]):
+            logging.info('  %-12s %8.1f s %5.1f%%', stage, seconds,
+                         100 * seconds / total if total else 0)
+        if self.stage_seconds:
+            slowest = max(self.stage_seconds, key=self.stage_seconds.get)
+            logging.info('Slowest stage: %s.', slowest)
+        if self.step_seconds:
+            slowest = max(self.step_seconds, key=self.step_seconds.get)
+            logging.info('Slowest step: %s, %.1f s.', slowest,
+                         self.step_seconds[slowest])
@@ -0,0 +1,50 @@
+"""Per track log files for cache builds.
+
+A worker can have several tracks in flight on different threads, so a
+track's handler only takes records logged by a thread while it's working on
+that track.
+"""
+
+import os
+import logging
+import threading
+from contextlib import contextmanager
+
+
+LOG_FORMAT = '%(asctime)s %(processName)s %(levelname)s %(message)s'
+
+_local = threading.local()
+
+
+class _TrackFilter(logging.Filter):
+    """Lets through records logged while the thread works on a track."""
+
+    def __init__(self, track_name: str):
+        super().__init__()
+        self.track_name = track_name
+
+    def filter(self, record) -> bool:
+        return getattr(_local, 'track_name', None) == self.track_name
+
+
+@contextmanager
+def track_logging(log_dir: str, track_name: str):
+    """Append what this thread logs to the track's log file while in the
+    block. Does nothing without a log dir."""
+    if log_dir is None:
+        yield
+        return
+
+    os.makedirs(log_dir, exist_ok=True)
+    base_name = os.path.splitext(os.path.basename(track_name))[0]
+    handler = logging.FileHandler(os.path.join(log_dir, f'{base_name}.log'))
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    handler.addFilter(_TrackFilter(track_name))
+    _local.track_name = track_name
+    logging.getLogger().addHandler(handler)
+    try:
+        yield
+    finally:
+        logging.getLogger().removeHandler(handler)
+        handler.close()
+        _local.track_name = None
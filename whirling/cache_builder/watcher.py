@@ -0,0 +1,147 @@
+"""Watch music directories for tracks to cache.
+
+New and modified audio files are noticed through inotify when the optional
+`inotify_simple` package is installed, and by periodically comparing file
+sizes and modification times otherwise. Either way nothing is decoded or
+hashed until a file is handed over.
+
+Copying an album in fires a stream of events per file, so changes are
+debounced. A file is only handed over once it's gone `debounce` seconds
+without changing.
+"""
+
+import os
+import time
+import logging
+
+try:
+    import inotify_simple
+except ImportError:
+    inotify_simple = None
+
+
+AUDIO_EXTENSIONS = {'.mp3', '.m4a', '.wav', '.flac', '.ogg', '.aiff', '.aif'}
+
+# Seconds a file has to go unchanged before it's built.
+DEFAULT_DEBOUNCE = 10
+
+# Seconds between directory scans when polling.
+POLL_INTERVAL = 5
+
+
+def is_audio_file(file_name: str) -> bool:
+    """Whether a file looks like a track."""
+    return os.path.splitext(file_name)[1].lower() in AUDIO_EXTENSIONS
+
+
+def walk_audio_files(dirs):
+    """Every audio file under dirs."""
+    for directory in dirs:
+        for root, _dirs, files in os.walk(directory):
+            for file_name in files:
+                if is_audio_file(file_name):
+                    yield os.path.join(root, file_name)
+
+
+class PollingBackend():
+    """Finds changes by rescanning the directories."""
+
+    def __init__(self, dirs):
+        self.dirs = dirs
+        self.snapshot = self.scan()
+
+    def scan(self):
+        """Size and modification time of every audio file."""
+        snapshot = {}
+        for file_name in walk_audio_files(self.dirs):
+            try:
+                stat = os.stat(file_name)
+            except FileNotFoundError:
+                continue
+            snapshot[file_name] = (stat.st_size, stat.st_mtime_ns)
+        return snapshot
+
+    def changes(self, timeout: float):
+        """Files added or modified since the last call."""
+        time.sleep(min(timeout, POLL_INTERVAL))
+        snapshot = self.scan()
+        changed = [f for f, stat in snapshot.items() if self.snapshot.get(f) != stat]
+        self.snapshot = snapshot
+        return changed
+
+
+class InotifyBackend():
+    """Finds changes through inotify watches on every directory."""
+
+    def __init__(self, dirs):
+        self.inotify = inotify_simple.INotify()
+        flags = inotify_simple.flags
+        self.mask = flags.CLOSE_WRITE | flags.MOVED_TO | flags.CREATE
+        self.watches = {}
+        for directory in dirs:
+            self.watch_tree(directory)
+
+    def watch_tree(self, directory):
+        """Watch a directory and everything under it."""
+        for root, _dirs, _files in os.walk(directory):
+            wd = self.inotify.add_watch(root, self.mask)
+            self.watches[wd] = root
+
+    def changes(self, timeout: float):
+        """Files written or moved in since the last call. Directories that
+        show up get watched, and their audio files count as changed."""
+        changed = []
+        flags = inotify_simple.flags
+        for event in self.inotify.read(timeout=int(timeout * 1000)):
+            root = self.watches.get(event.wd)
+            if root is None or not event.name:
+                continue
+            path = os.path.join(root, event.name)
+            if event.mask & flags.ISDIR:
+                self.watch_tree(path)
+                changed.extend(walk_audio_files([path]))
+            elif event.mask & (flags.CLOSE_WRITE | flags.MOVED_TO) and \
+                    is_audio_file(event.name):
+                changed.append(path)
+        return changed
+
+
+class DirectoryWatcher():
+    """Hands over audio files under dirs once they've settled."""
+
+    def __init__(self, dirs, debounce: float = DEFAULT_DEBOUNCE):
+        self.dirs = dirs
+        self.debounce = debounce
+        if inotify_simple is not None:
+            self.backend = InotifyBackend(dirs)
+        else:
+            logging.info('inotify_simple isn\'t installed, polling for changes.')
+            self.backend = PollingBackend(dirs)
+
+        # Changed files by when they last changed.
+        self.unsettled = {}
+
+    def existing_tracks(self):
+        """Every audio file there already is."""
+        return sorted(walk_audio_files(self.dirs))
+
+    def wait_for_tracks(self):
+        """Block until some changed files have settled and return them."""
+        while True:
+            timeout = self.debounce if self.unsettled else POLL_INTERVAL
+
+            # Stamped once the backend returns, since it blocks for up to
+            # timeout seconds and the changes may have come at its end.
+            changes = self.backend.changes(timeout)
+            now = time.time()
+            for file_name in changes:
+                self.unsettled[file_name] = now
+
+            now = time.time()
+            settled = sorted(f for f, changed in self.unsettled.items()
+                             if now - changed >= self.debounce)
+            for file_name in settled:
+                del self.unsettled[file_name]
+            settled = [f for f in settled if os.path.exists(f)]
+            if settled:
+                return settled
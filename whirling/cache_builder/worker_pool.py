@@ -0,0 +1,389 @@
+"""A pool of long-lived worker processes that generate dnz files.
+
+Each worker loads Spleeter once and serves many tracks. The pool hands tracks
+to workers with room for them, keeps up to `jobs` workers busy and replaces
+workers that get recycled or die. A track that fails, even by taking its
+worker down with it, is recorded and the rest of the run carries on.
+
+A worker normally builds one track at a time. A pipelined worker runs each
+stage group of the build on its own thread and takes one track per group.
+
+Given a memory model and budget, tracks are only started while the sum of
+their estimated peaks fits the budget. Tracks are taken largest first and the
+largest one that fits goes next, so long tracks end up running alone and short
+ones get packed in around them.
+"""
+
+import time
+import queue
+import logging
+import multiprocessing
+from whirling.cache_builder import memory
+from whirling.cache_builder.timing import StageProfiler
+from whirling.cache_builder.pipeline import StagePipeline, PIPELINE_GROUPS
+from whirling.cache_builder.track_logs import track_logging
+from whirling.tools.process_memory import rss_mb, peak_rss_mb
+
+
+class WorkerHandle():
+    """The parent's view of a worker process."""
+
+    def __init__(self, name: str, process, task_queue, capacity: int):
+        self.name = name
+        self.process = process
+        self.task_queue = task_queue
+        self.capacity = capacity
+        self.tracks = []
+        self.retiring = False
+
+    @property
+    def has_room(self) -> bool:
+        return len(self.tracks) < self.capacity and not self.retiring
+
+
+class WorkerPool():
+    """Generates dnz files for tracks across up to `jobs` worker processes."""
+
+    def __init__(self, store, jobs: int = 1, max_tracks_per_worker: int = 25,
+                 max_worker_growth_mb: int = 2048, log_dir: str = None,
+                 memory_model: memory.MemoryModel = None,
+                 max_memory_mb: float = None, manifest=None, locks=None,
+                 pipelined: bool = False, timing_report=None,
+                 blast_cache: bool = False, verify_cache: bool = False):
+        self.store = store
+        self.jobs = jobs
+        self.pipelined = pipelined
+        self.worker_capacity = len(PIPELINE_GROUPS) if pipelined else 1
+        self.memory_model = memory_model
+        self.max_memory_mb = max_memory_mb
+        self.manifest = manifest
+        self.locks = locks
+        self.timing_report = timing_report
+        self.blast_cache = blast_cache
+        self.verify_cache = verify_cache
+        self.max_tracks_per_worker = max_tracks_per_worker
+        self.max_worker_growth_mb = max_worker_growth_mb
+        self.log_dir = log_dir
+
+        self.status_queue = multiprocessing.Queue()
+        self.workers = {}
+        self.worker_count = 0
+
+        # Results.
+        self.finished = []
+        self.failed = []
+        self.skipped = []
+
+    def run(self, tracks):
+        """Generate dnz files for all tracks. Returns once every track has
+        finished or failed, with the results of just these tracks. Workers
+        stay up for the next run until the pool is closed."""
+        self.finished, self.failed, self.skipped = [], [], []
+        self.reap_workers()
+        pending = list(tracks)
+        if self.max_memory_mb is not None:
+            pending.sort(key=self.memory_model.estimate_mb, reverse=True)
+        while pending or any(w.tracks for w in self.workers.values()):
+            self.assign_tracks(pending)
+            self.fill_pool(pending)
+            self.handle_status(timeout=1)
+            self.reap_workers()
+            if self.locks is not None:
+                self.locks.refresh()
+
+        self.log_summary()
+        if self.timing_report is not None:
+            self.timing_report.log_summary()
+        return self.finished, self.failed
+
+    def close(self):
+        """Let the workers go."""
+        for worker in self.workers.values():
+            if not worker.retiring:
+                worker.task_queue.put(None)
+        for worker in self.workers.values():
+            worker.process.join()
+        self.workers = {}
+
+    def fill_pool(self, pending):
+        """Start workers for pending tracks until there's one per job. Called
+        after workers with room got their tracks so none sit around unused."""
+        while len(self.workers) < self.jobs and pending:
+            track = self.next_track(pending)
+            if track is None:
+                return
+            self.start_worker(track)
+
+    def start_worker(self, track):
+        """Start a worker process and hand it its first track."""
+        self.worker_count += 1
+        name = f'worker-{self.worker_count}'
+        task_queue = multiprocessing.Queue()
+        process = multiprocessing.Process(
+            target=serve_tracks, name=name,
+            args=(name, self.store, task_queue, self.status_queue,
+                  self.max_tracks_per_worker, self.max_worker_growth_mb,
+                  self.log_dir, self.pipelined))
+        process.start()
+        worker = WorkerHandle(name, process, task_queue, self.worker_capacity)
+        self.workers[name] = worker
+        self.hand_off(worker, track)
+
+    def assign_tracks(self, pending):
+        """Hand pending tracks to workers with room for them."""
+        for worker in self.workers.values():
+            while pending and worker.has_room:
+                track = self.next_track(pending, worker)
+                if track is None:
+                    return
+                self.hand_off(worker, track)
+
+    def hand_off(self, worker, track):
+        """Send a track to a worker."""
+        worker.tracks.append(track)
+        worker.task_queue.put(track)
+        if self.manifest is not None:
+            self.manifest.mark(track, self.store.plan_hash, None, 'started')
+
+    def next_track(self, pending, worker=None):
+        """Pick the next track to run and claim it. Tracks another host holds
+        the lock of are skipped. None means nothing should start right now,
+        pending may have run out."""
+        while True:
+            track = self.pick_track(pending, worker)
+            if track is None or self.locks is None:
+                return track
+            if not self.locks.acquire(self.lock_name(track)):
+                logging.info('Skipping %s, another host is building it.', track)
+            elif self.built_elsewhere(track):
+                # Another host finished it since the run started.
+                self.locks.release(self.lock_name(track))
+                logging.info('Skipping %s, another host built it.', track)
+            else:
+                return track
+            self.skipped.append(track)
+
+    def built_elsewhere(self, track) -> bool:
+        """Whether another host built a track since the run started. Pending
+        tracks were checked the same way at the start, so with a blasted
+        cache every track is built, and with a verified one only dnz files
+        that pass verification count."""
+        if self.blast_cache:
+            return False
+        return self.store.store_cache_exists(track, self.verify_cache)
+
+    def lock_name(self, track):
+        """Name of a track's lock file, next to its dnz file."""
+        return self.store.store_file_name(track) + '.lock'
+
+    def pick_track(self, pending, worker=None):
+        """Pick the next track to run, removing it from pending. None means
+        nothing should start right now. Worker is the worker it's for, or
+        None for a new one."""
+        # Skipped tracks can use up the rest of pending mid pick.
+        if not pending:
+            return None
+        if self.max_memory_mb is None:
+            return pending.pop(0)
+
+        # Every worker holds its models whether it's busy or not. A new one
+        # brings its own.
+        baseline_mb = self.memory_model.baseline_mb
+        in_use = sum(self.worker_memory_mb(w) for w in self.workers.values())
+        if worker is None:
+            in_use += baseline_mb
+        for i, track in enumerate(pending):
+            needed = self.memory_model.estimate_mb(track) - baseline_mb
+            if in_use + needed <= self.max_memory_mb:
+                return pending.pop(i)
+
+        # A track over the whole budget still has to run sometime. Run it once
+        # nothing else is.
+        if all(not w.tracks for w in self.workers.values()):
+            track = pending.pop(0)
+            logging.warning('Track %s is estimated at %.0f MB, over the %.0f MB'
+                            ' budget. Running it alone.', track,
+                            self.memory_model.estimate_mb(track), self.max_memory_mb)
+            return track
+        return None
+
+    def worker_memory_mb(self, worker) -> float:
+        """Estimated peak memory of a worker with the tracks it has now."""
+        baseline_mb = self.memory_model.baseline_mb
+        return baseline_mb + sum(self.memory_model.estimate_mb(t) - baseline_mb
+                                 for t in worker.tracks)
+
+    def handle_status(self, timeout):
+        """Process status messages from the workers."""
+        while True:
+            try:
+                name, status, track, detail = self.status_queue.get(timeout=timeout)
+            except queue.Empty:
+                return
+            timeout = 0
+            worker = self.workers[name]
+            if status == 'finished':
+                worker.tracks.remove(track)
+                self.on_finished(track, detail)
+            elif status == 'failed':
+                worker.tracks.remove(track)
+                self.on_failed(track, detail)
+            elif status == 'recycling' and not worker.retiring:
+                # The worker finishes what it has then exits on the None.
+                worker.retiring = True
+                worker.task_queue.put(None)
+
+    def reap_workers(self):
+        """Clean up workers that exited. Any track one was working on is
+        counted as failed."""
+        dead = [w for w in self.workers.values() if not w.process.is_alive()]
+        if not dead:
+            return
+
+        # Messages a worker sent right before exiting may still be queued.
+        self.handle_status(timeout=0.1)
+        for worker in dead:
+            worker.process.join()
+            for track in worker.tracks:
+                self.on_failed(track,
+                               f'{worker.name} exited with code {worker.process.exitcode}')
+            del self.workers[worker.name]
+
+    def on_finished(self, track, detail):
+        """Record a finished track."""
+        self.finished.append(track)
+        if self.locks is not None:
+            self.locks.release(self.lock_name(track))
+        # Tracks sharing a pipelined worker can't be measured apart.
+        if self.memory_model is not None and 'start_rss_mb' in detail:
+            self.memory_model.record(track, detail['start_rss_mb'], detail['peak_rss_mb'],
+                                     detail['first'])
+        if self.timing_report is not None:
+            self.timing_report.record(track, detail['seconds'], detail['stages'],
+                                      detail.get('peak_rss_mb'))
+
+    def on_failed(self, track, reason):
+        """Record a failed track."""
+        logging.error('Failed track %s: %s', track, reason)
+        self.failed.append((track, reason))
+        if self.locks is not None:
+            self.locks.release(self.lock_name(track))
+        if self.manifest is not None:
+            self.manifest.mark(track, self.store.plan_hash, None, 'failed', reason)
+
+    def log_summary(self):
+        """Log how the run went."""
+        logging.info('Finished %d tracks, %d failed, %d skipped.',
+                     len(self.finished), len(self.failed), len(self.skipped))
+        for track, reason in self.failed:
+            logging.error('  %s: %s', track, reason)
+
+
+###############################################################################
+# Worker process.
+###############################################################################
+
+def serve_tracks(name, store, task_queue, status_queue, max_tracks,
+                 max_growth_mb, log_dir=None, pipelined=False):
+    """Worker process loop. Generates dnz files for tracks it's handed,
+    reusing the loaded separation models across tracks. After max_tracks
+    tracks, or once resident memory grows max_growth_mb past where it was
+    after the first track, it asks to be recycled. It finishes the tracks it
+    already has and exits when handed None. That keeps leaks in TensorFlow
+    in check without paying for a model load per track."""
+    profiler = StageProfiler(store.stage_listener)
+    store.stage_listener = profiler.on_stage
+    if pipelined:
+        serve_tracks_pipelined(name, store, task_queue, status_queue,
+                               max_tracks, max_growth_mb, log_dir, profiler)
+        store.audio_hashes.flush()
+        return
+
+    baseline_mb = None
+    count = 0
+    while True:
+        track = task_queue.get()
+        if track is None:
+            # Worker processes skip exit handlers.
+            store.audio_hashes.flush()
+            return
+        count += 1
+
+        start_mb = rss_mb()
+        start = time.time()
+        with track_logging(log_dir, track):
+            # Called directly rather than through current_track_bs, an
+            # exception there would unsubscribe the store for good.
+            try:
+                logging.info('Processing track: %s', track)
+                store.load_plan_output(track)
+            except Exception as e:  # pylint: disable=broad-except
+                logging.exception('Failed processing track: %s', track)
+                profiler.pop(track)
+                status_queue.put((name, 'failed', track, repr(e)))
+                continue
+
+        # The store measures peaks step by step.
+        stages = profiler.pop(track)
+        peak_mb = max([p['peak_rss_mb'] for p in stages.values()], default=start_mb)
+        end_mb = rss_mb()
+        logging.info('Peak RSS processing %s: %.1f MB', track, peak_mb)
+        if baseline_mb is None:
+            baseline_mb = end_mb
+
+        if count >= max_tracks or end_mb - baseline_mb > max_growth_mb:
+            request_recycle(name, status_queue, count, end_mb - baseline_mb)
+        status_queue.put((name, 'finished', track, {
+            'first': count == 1,
+            'start_rss_mb': start_mb,
+            'peak_rss_mb': peak_mb,
+            'seconds': time.time() - start,
+            'stages': stages
+        }))
+
+
+def serve_tracks_pipelined(name, store, task_queue, status_queue, max_tracks,
+                           max_growth_mb, log_dir, profiler):
+    """Worker process loop that overlaps the stages of the tracks it has. The
+    stages run on threads sharing the process's peak memory, so none of them
+    reset it."""
+    store.measure_step_peaks = False
+    counts = {'taken': 0, 'finished': 0}
+    baseline = {}
+    starts = {}
+
+    def next_track():
+        track = task_queue.get()
+        if track is not None:
+            starts[track] = time.time()
+            counts['taken'] += 1
+            if counts['taken'] == max_tracks:
+                request_recycle(name, status_queue, max_tracks, 0)
+        return track
+
+    def on_result(track, error):
+        stages = profiler.pop(track)
+        seconds = time.time() - starts.pop(track)
+        if error is not None:
+            status_queue.put((name, 'failed', track, error))
+            return
+        counts['finished'] += 1
+        end_mb = rss_mb()
+        baseline.setdefault('mb', end_mb)
+        if end_mb - baseline['mb'] > max_growth_mb:
+            request_recycle(name, status_queue, counts['finished'],
+                            end_mb - baseline['mb'])
+        status_queue.put((name, 'finished', track, {
+            'seconds': seconds,
+            'peak_rss_mb': peak_rss_mb(),
+            'stages': stages
+        }))
+
+    StagePipeline(store, log_dir=log_dir).run(next_track, on_result)
+
+
+def request_recycle(name, status_queue, count, growth_mb):
+    """Ask the pool to stop sending tracks and let this worker go."""
+    logging.info('Recycling %s after %d tracks, memory grew %.1f MB.',
+                 name, count, growth_mb)
+    status_queue.put((name, 'recycling', None, None))
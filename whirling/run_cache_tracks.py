@@ -5,13 +5,20 @@ audio clip.
 Start with `run_cache_tracks --help`
 """
 
+import sys
 import logging
 import argparse
-import multiprocessing
 import coloredlogs
-import tensorflow as tf
 from data.tracks import MUSIC_TRACKS
 from whirling.store import Store
+from whirling.cache_builder import shards
+from whirling.cache_builder.memory import MemoryModel
+from whirling.cache_builder.manifest import Manifest, track_status
+from whirling.cache_builder.track_logs import LOG_FORMAT
+from whirling.cache_builder.timing import TimingReport
+from whirling.cache_builder.estimate import CostModel, estimate_build, print_estimate
+from whirling.cache_builder.worker_pool import WorkerPool
+from whirling.cache_builder.watcher import DirectoryWatcher, DEFAULT_DEBOUNCE
 
 
 ###############################################################################
@@ -29,38 +36,155 @@ class CacheTracks():
         """Initialize class"""
         # Parse options.
         args = parse_options()
-        plan = args.plan
-        blast_cache = args.blast_cache
+        plans = args.plan
+        self.blast_cache = args.blast_cache
+        self.verify_cache = args.verify_cache
+        self.max_tracks_per_worker = args.max_tracks_per_worker
+        self.max_worker_growth_mb = args.max_worker_growth_mb
+        self.jobs = args.jobs
+        self.log_dir = args.log_dir
+        self.max_memory_mb = args.max_memory
+        self.shard_index = args.shard_index
+        self.shard_count = args.shard_count
+        self.pipeline = args.pipeline
+        self.failed = []
 
-        # Initialize store.
+        # Tracks whose artifacts were already purged for --blast-cache.
+        self.blasted = set()
+
+        # Initialize store. Workers generate track after track so there's no
+        # point holding onto finished plan outputs.
         self.store = Store.get_instance()
-        self.store.initialize(plan, use_cache=False)
+        self.store.initialize(plans[0], use_cache=False, lru_budget=0)
+
+        # Record how far along each track gets so progress can be checked and
+        # interrupted builds picked back up.
+        self.manifest = Manifest(self.store.cache_dir)
+
+        if args.watch:
+            self.watch_directories(args.watch, plans, args.debounce)
+            return
+
+        for plan in plans:
+            self.use_plan(plan)
+
+            # Only this host's share of the library. The split is by duration
+            # so every shard takes about as long.
+            tracks = shards.shard_tracks(MUSIC_TRACKS, self.shard_index,
+                                         self.shard_count, self.memory_model.duration)
+            if args.status:
+                self.print_status(tracks)
+            elif args.estimate:
+                # Everything in the shard, as if the cache were blasted.
+                print_estimate(estimate_build(
+                    tracks, self.store.active_plan, self.merged,
+                    CostModel(self.store.cache_dir), self.memory_model, self.jobs))
+            else:
+                # Find unprocessed tracks then generate dnz files for them.
+                tracks = self.get_unprocessed_tracks(tracks, self.blast_cache)
+                self.log_resumed(tracks)
+                self.generate_dnz_files(tracks)
+
+    def use_plan(self, plan):
+        """Switch the store over to a plan. Workers started after this build
+        with it."""
+        self.store.use_plan(plan)
+        logging.info('Using plan %s.', plan)
+        self.store.stage_listener = self.manifest.listener(self.store.plan_hash)
 
-        # Find unprocessed tracks then generate dnz files for them.
-        tracks = self.get_unprocessed_tracks(MUSIC_TRACKS, blast_cache)
-        self.generate_dnz_files(tracks)
+        # Signals the plan asks for, to estimate memory and cost with.
+        self.merged = self.store.merge_plan_signal_defs(self.store.active_plan)
+        self.memory_model = MemoryModel(self.store.cache_dir, self.merged['signals'])
 
-    def generate_dnz_files(self, tracks):
-        """Iterates on tracks while generating the dnz files."""
+    def watch_directories(self, dirs, plans, debounce):
+        """Build caches for tracks under dirs as they're added or modified,
+        until interrupted. Tracks already there get built first. Each plan
+        keeps its pool of workers, and their loaded models, the whole time."""
+        watcher = DirectoryWatcher(dirs, debounce)
+        tracks = watcher.existing_tracks()
+        logging.info('Watching %s.', ', '.join(dirs))
+        pools = {}
+        try:
+            while True:
+                for plan in plans:
+                    self.use_plan(plan)
+                    unprocessed = self.get_unprocessed_tracks(tracks, False)
+                    if not unprocessed:
+                        continue
+                    if plan not in pools:
+                        pools[plan] = self.worker_pool(blast_cache=False)
+                    self.generate_dnz_files(unprocessed, pools[plan])
+                tracks = watcher.wait_for_tracks()
+                logging.info('%d tracks changed.', len(tracks))
+        finally:
+            for pool in pools.values():
+                pool.close()
+
+    def worker_pool(self, blast_cache: bool = None) -> WorkerPool:
+        """A pool of workers building with the current plan. It rebuilds
+        tracks that already have dnz files when blasting the cache, which
+        defaults to --blast-cache."""
+        if blast_cache is None:
+            blast_cache = self.blast_cache
+        # Peaks are measured even without a budget so estimates keep improving.
+        # Tracks are locked even on one host so overlapping runs stay apart.
+        return WorkerPool(self.store, self.jobs, self.max_tracks_per_worker,
+                          self.max_worker_growth_mb, self.log_dir,
+                          self.memory_model, self.max_memory_mb, self.manifest,
+                          shards.TrackLocks(), self.pipeline,
+                          TimingReport(self.store.cache_dir, self.memory_model.duration),
+                          blast_cache, self.verify_cache)
+
+    def generate_dnz_files(self, tracks, pool=None):
+        """Generates dnz files across a pool of worker processes, a new one
+        unless given one to reuse. Tracks that fail get reported at the end
+        instead of stopping the run."""
         logging.info('Number of tracks working on: %d', len(tracks))
+        if pool is not None:
+            _finished, failed = pool.run(tracks)
+        else:
+            pool = self.worker_pool()
+            try:
+                _finished, failed = pool.run(tracks)
+            finally:
+                pool.close()
+        self.failed.extend(failed)
 
+    def log_resumed(self, tracks):
+        """Log the tracks an earlier run left unfinished. Whatever stages
+        they got through come back out of the artifact cache."""
+        states = self.manifest.states(self.store.plan_hash)
         for track in tracks:
-            logging.info('Processing track: %s', track)
-            tf.keras.backend.clear_session()
-            process_eval = multiprocessing.Process(
-                target=run_track, args=(self.store, track))
-            process_eval.start()
-            process_eval.join()
+            if track in states:
+                logging.info('Resuming %s, %s.', track, track_status(states[track]))
 
+    def print_status(self, tracks):
+        """Print where every track is according to the manifest. Nothing is
+        hashed, decoded or generated."""
+        states = self.manifest.states(self.store.plan_hash)
+        counts = {}
+        for track in tracks:
+            status = track_status(states.get(track))
+            summary = status.split(' ')[0].strip(':,')
+            counts[summary] = counts.get(summary, 0) + 1
+            print(f'{track}: {status}')
+        print(', '.join(f'{n} {summary}' for summary, n in sorted(counts.items())))
 
     def get_unprocessed_tracks(self, tracks, blast_cache):
-        """Determines what tracks don't have dnz files yet."""
+        """Determines what tracks don't have dnz files yet. Blasting the cache
+        rebuilds every track, purging its artifacts first so nothing comes
+        from the artifact cache either. They're purged once per run, not per
+        plan, so later plans reuse what the first one recomputed."""
         if blast_cache:
+            for track in tracks:
+                if track not in self.blasted:
+                    self.store.purge_artifacts(track)
+                    self.blasted.add(track)
             return tracks
 
         ret_tracks = []
         for track in tracks:
-            if not self.store.store_cache_exists(track):
+            if not self.store.store_cache_exists(track, self.verify_cache):
                 ret_tracks.append(track)
 
         return ret_tracks
@@ -75,24 +199,63 @@ def parse_options():
         " segmentations for a specified plan on all tracks."
     epilog = "Usage: run_cache_tracks --plan default_plan"
     parser = argparse.ArgumentParser(description=description, epilog=epilog)
-    parser.add_argument('--plan', type=str, default='default_plan',
-                        help='A plan to generate data from a list of songs.')
+    parser.add_argument('--plan', type=str, nargs='+', default=['default_plan'],
+                        help='Plans to generate data from a list of songs.')
     parser.add_argument('--blast-cache', default=False, action='store_true',
-                        help='Erase and recreate track cache.')
+                        help='Erase and recreate track cache, artifacts'
+                        ' included.')
+    parser.add_argument('--verify-cache', default=False, action='store_true',
+                        help='Checksum existing cache files and rebuild the'
+                        ' ones that fail.')
+    parser.add_argument('--jobs', type=int, default=1,
+                        help='Number of tracks to process at once, each in'
+                        ' its own worker process.')
+    parser.add_argument('--log-dir', type=str, default=None,
+                        help='Also write each track\'s logs to its own file'
+                        ' in this directory.')
+    parser.add_argument('--status', default=False, action='store_true',
+                        help='Print how far along each track is and exit.')
+    parser.add_argument('--pipeline', default=False, action='store_true',
+                        help='Overlap decoding, separation and analysis of'
+                        ' consecutive tracks within each worker.')
+    parser.add_argument('--estimate', default=False, action='store_true',
+                        help='Print the expected CPU time, peak memory and'
+                        ' disk use of building every track and exit.')
+    parser.add_argument('--max-tracks-per-worker', type=int, default=25,
+                        help='Tracks a worker process serves before it is'
+                        ' replaced with a fresh one.')
+    parser.add_argument('--max-worker-growth-mb', type=int, default=2048,
+                        help='Replace a worker once its memory grows this'
+                        ' much past where it was after the first track.')
+    parser.add_argument('--max-memory', type=int, default=None,
+                        help='Memory budget in MB. Tracks only start while'
+                        ' their estimated peaks fit in it together.')
+    parser.add_argument('--shard-index', type=int, default=0,
+                        help='Which shard of the tracks this host builds,'
+                        ' from 0 to shard count - 1.')
+    parser.add_argument('--shard-count', type=int, default=1,
+                        help='Number of hosts splitting the tracks between'
+                        ' them. Every host needs the same count.')
+    parser.add_argument('--watch', type=str, nargs='+', default=None,
+                        help='Instead of the tracks file, keep building caches'
+                        ' for audio files added to or changed in these'
+                        ' directories until interrupted.')
+    parser.add_argument('--debounce', type=float, default=DEFAULT_DEBOUNCE,
+                        help='Seconds a watched file has to go unchanged'
+                        ' before it is built.')
     args = parser.parse_args()
+    if args.shard_count < 1 or not 0 <= args.shard_index < args.shard_count:
+        parser.error('--shard-index must be in [0, --shard-count).')
     return args
 
 
-def run_track(store, track):
-    """Kicks off the dnz file generation process."""
-    store.current_track_bs.on_next(track)
-
-
 ###############################################################################
 # Main and option handling.
 ###############################################################################
 
 def main():
     """Initialize the program."""
-    coloredlogs.install()
-    CacheTracks()
+    coloredlogs.install(fmt=LOG_FORMAT)
+    cache_tracks = CacheTracks()
+    if cache_tracks.failed:
+        sys.exit(1)
@@ -34,7 +34,9 @@ class Whirling():
     song that's playing so it could create a more representative visual. It
     uses track segmentation and audio feature extraction to do so.
     """
-    def __init__(self, plan, display_w, display_h, use_cache=False):
+    def __init__(self, plan, display_w, display_h, use_cache=False,
+                 prefetch_budget_mb=1024, prefetch_previous=False,
+                 prefetch_generate=False, lru_budget_mb=2048):
         """Initialize class."""
 
         # Initialize window and pygame.
@@ -60,7 +62,13 @@ class Whirling():
 
         # Initialize store.
         self.store = Store.get_instance()
-        self.store.initialize(plan, use_cache)
+        self.store.initialize(
+            plan, use_cache, async_loading=True,
+            prefetch_budget=prefetch_budget_mb * 1024 * 1024,
+            prefetch_previous=prefetch_previous,
+            prefetch_generate=prefetch_generate,
+            lru_budget=lru_budget_mb * 1024 * 1024,
+            watch_plan=True, blast_artifacts=not use_cache)
 
         # Initialize pygame and opengl.
         pg.init()
@@ -122,6 +130,7 @@ class Whirling():
                 self.visualizer_controller.handle_event(event)
 
             # Update
+            self.store.update()
             self.audio_controller.update()
             self.fps.text = str(int(self.clock.get_fps()))
 
@@ -191,8 +200,21 @@ def parse_options():
     parser.add_argument('--plan', type=str, default='default_plan',
                         help='A plan to generate data from a list of songs.')
     parser.add_argument('--use-cache', default=False, action='store_true',
-                        help='Load cached audio features stored as pickle files'
-                        ' along side the original audio file.')
+                        help='Load cached audio features stored as dnz files'
+                        ' in the cache directory. Without it every track is'
+                        ' regenerated from scratch.')
+    parser.add_argument('--prefetch-budget-mb', type=int, default=1024,
+                        help='Memory budget in MB for plan outputs of upcoming'
+                        ' tracks loaded ahead of time.')
+    parser.add_argument('--prefetch-previous', default=False, action='store_true',
+                        help='Also prefetch the previous track.')
+    parser.add_argument('--prefetch-generate', default=False, action='store_true',
+                        help='Generate upcoming tracks that aren\'t cached'
+                        ' while prefetching. Switching to a track while another'
+                        ' one generates waits for it to finish.')
+    parser.add_argument('--lru-budget-mb', type=int, default=2048,
+                        help='Memory budget in MB for plan outputs of recently'
+                        ' played tracks.')
     parser.add_argument('--move-window', default=False, action='store_true',
                         help='Moves window to my preferred location')
     parser.add_argument('--move-window2', default=False, action='store_true',
@@ -217,4 +239,8 @@ def main():
         os.environ['SDL_VIDEO_WINDOW_POS'] = "%d,%d" % (0, 800)
 
     Whirling(args.plan, display_width, display_height,
-             use_cache=args.use_cache)
+             use_cache=args.use_cache,
+             prefetch_budget_mb=args.prefetch_budget_mb,
+             prefetch_previous=args.prefetch_previous,
+             prefetch_generate=args.prefetch_generate,
+             lru_budget_mb=args.lru_budget_mb)
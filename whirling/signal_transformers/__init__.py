@@ -1,12 +1,71 @@
 """Initialize package."""
 
-# What are the valid signals that can be defined in a plan.
-VALID_SIGNALS = [
-    "full",
-    "librosa_harmonic",
-    "librosa_percussive",
-    "spleeter_vocals",
-    "spleeter_bass",
-    "spleeter_drums",
-    "spleeter_other"
+# How tracks get resampled to a plan's sr, fastest last. These are librosa's
+# res_type values. kaiser_best is librosa's default and the slowest.
+RESAMPLERS = [
+    "kaiser_best",
+    "kaiser_fast",
+    "polyphase",
 ]
+DEFAULT_RESAMPLER = "kaiser_best"
+
+# Spleeter models by the stems they separate, cheapest first. Accompaniment is
+# everything but the vocals, 4stems makes it by adding its other stems up.
+SPLEETER_MODELS = [
+    ("spleeter:2stems", ["vocals", "accompaniment"]),
+    ("spleeter:4stems", ["vocals", "drums", "bass", "other"]),
+]
+
+# Where the band splitter's low, mid and high bands meet.
+BAND_CROSSOVERS_HZ = [250, 4000]
+
+# How much the fast HPSS shrinks the spectrogram along each axis before
+# median filtering it.
+FAST_HPSS_DECIMATION = 4
+
+
+def plan_signal_names(plan):
+    """Every signal a plan's visualizers ask for."""
+    return set(sig for v_obj in plan['visualizers'].values()
+               for sig in v_obj['signals'])
+
+
+def spleeter_model(plan) -> str:
+    """The cheapest spleeter model that separates every spleeter signal a
+    plan asks for."""
+    stems = set(s[len('spleeter_'):] for s in plan_signal_names(plan)
+                if s.startswith('spleeter_'))
+    for model, model_stems in SPLEETER_MODELS:
+        if stems <= set(model_stems):
+            return model
+    return SPLEETER_MODELS[-1][0]
+
+
+def stft_signal(signal_name: str) -> bool:
+    """Whether a signal is made as an stft, like the HPSS signals. Its stft
+    is what's kept and its samples are only synthesized when needed."""
+    return signal_name.startswith(('librosa_', 'fast_'))
+
+
+def signal_params(plan, signal_name: str):
+    """The plan parameters a signal depends on. Used to key cached artifacts
+    so anything derived from a signal is only reused when the signal would
+    have come out the same."""
+    metadata = plan['metadata']
+    params = {'signal': signal_name, 'sr': metadata['sr']}
+
+    # Left out at the default so artifacts cached before it existed match.
+    resampler = metadata.get('resampler', DEFAULT_RESAMPLER)
+    if resampler != DEFAULT_RESAMPLER:
+        params['resampler'] = resampler
+    if stft_signal(signal_name):
+        params['n_fft'] = metadata['n_fft']
+        params['hop_length'] = metadata['hop_length']
+        params['synthesis'] = 'plan_window'
+    if signal_name.startswith('fast_'):
+        params['decimation'] = FAST_HPSS_DECIMATION
+    if signal_name.startswith('spleeter_'):
+        params['model'] = spleeter_model(plan)
+    elif signal_name.startswith('bands_'):
+        params['crossovers'] = BAND_CROSSOVERS_HZ
+    return params
@@ -5,6 +5,7 @@ import numpy as np
 import librosa
 import sklearn
 from schema import Schema, Optional
+from whirling.signal_transformers import signal_params, stft_signal
 
 
 FEATURES_SCHEMA = Schema({
@@ -33,30 +34,58 @@ def get_frame_number(time, sr, hop_length):
     return librosa.core.time_to_frames([time], sr, hop_length)[0]
 
 
+# Features of stft signals are computed from their stft rather than samples,
+# so y is None and D is the stft at the plan's n_fft and hop_length.
+
+def magnitudes(y, D, hop_length):
+    """Magnitude spectrogram, 2048 bins wide when made from samples."""
+    if y is None:
+        return np.abs(D)
+    return np.abs(librosa.stft(y, n_fft=2048, hop_length=hop_length))
+
+
+def stft_onset_envelope(D, sr):
+    """Onset strength envelope of an stft, the way librosa makes it from
+    samples but at the stft's hop."""
+    S = librosa.feature.melspectrogram(S=np.abs(D) ** 2, sr=sr)
+    return librosa.onset.onset_strength(S=librosa.power_to_db(S), sr=sr)
+
+
 ###############################################################################
 # Feature extracting.
 ###############################################################################
 
 def get_frame_times(y, D, sr, hop_length):
+    if y is None:
+        return librosa.frames_to_time(range(D.shape[1]), sr=sr, hop_length=hop_length)
     return librosa.samples_to_time(range(0, len(y), hop_length), sr=sr)
 
 
 def get_rms(y, D, sr, hop_length):
     """Get root mean square of an audio signal. Sort of like volume of loudness
     but not really since what humans perceive as being loud is non-trivial."""
-    rms = librosa.feature.rms(y, hop_length=hop_length)[0]
+    if y is None:
+        rms = librosa.feature.rms(S=np.abs(D), frame_length=2 * (D.shape[0] - 1))[0]
+    else:
+        rms = librosa.feature.rms(y, hop_length=hop_length)[0]
     return normalize(rms)
 
 
 def get_spectral_centroids(y, D, sr, hop_length):
     """Basically an average all frequency bins weighted by their intensity."""
-    spectral_centroids = librosa.feature.spectral_centroid(y, sr=sr, hop_length=hop_length)[0]
+    if y is None:
+        spectral_centroids = librosa.feature.spectral_centroid(S=np.abs(D), sr=sr)[0]
+    else:
+        spectral_centroids = librosa.feature.spectral_centroid(y, sr=sr, hop_length=hop_length)[0]
     return normalize(spectral_centroids)
 
 
 def get_spectral_flatness(y, D, sr, hop_length):
     """An attempt to quantify how noisy a signal is."""
-    spectral_flatness = librosa.feature.spectral_flatness(y, hop_length=hop_length)[0]
+    if y is None:
+        spectral_flatness = librosa.feature.spectral_flatness(S=np.abs(D))[0]
+    else:
+        spectral_flatness = librosa.feature.spectral_flatness(y, hop_length=hop_length)[0]
     return normalize(spectral_flatness)
 
 
@@ -67,17 +96,28 @@ def get_zero_crossing_rates(y, D, sr, hop_length):
 
 
 def get_beats(y, D, sr, hop_length):
-    tempo, beat_frames = librosa.beat.beat_track(y=y, sr=sr, hop_length=hop_length)
+    if y is None:
+        tempo, beat_frames = librosa.beat.beat_track(
+            onset_envelope=stft_onset_envelope(D, sr), sr=sr,
+            hop_length=hop_length)
+    else:
+        tempo, beat_frames = librosa.beat.beat_track(y=y, sr=sr, hop_length=hop_length)
     logging.info('Estimated tempo: {:.2f} beats per minute'.format(tempo))
     return beat_frames
 
 
 def get_onsets(y, D, sr, hop_length):
+    if y is None:
+        return librosa.onset.onset_detect(
+            onset_envelope=stft_onset_envelope(D, sr), sr=sr,
+            hop_length=hop_length)
     onsets = librosa.onset.onset_detect(y=y, sr=sr, hop_length=hop_length)
     return onsets
 
 
 def get_onset_strength(y, D, sr, hop_length):
+    if y is None:
+        return normalize(stft_onset_envelope(D, sr))
     onset_strength = librosa.onset.onset_strength(y=y, sr=sr)
     return normalize(onset_strength)
 
@@ -85,8 +125,7 @@ def get_onset_strength(y, D, sr, hop_length):
 def get_loudness(y, D, sr, hop_length):
     """An attempt to quantify how loud a track is. It's more complex but this
     is an okay approximation. Better than RMS."""
-    n_fft = 2048
-    S = np.abs(librosa.stft(y, n_fft=n_fft, hop_length=hop_length))
+    S = magnitudes(y, D, hop_length)
     power = np.abs(S)**2
     p_mean = np.sum(power, axis=0, keepdims=True)
     p_ref = np.max(power)  # or whatever other reference power you want to use
@@ -102,8 +141,7 @@ def smooth_operator(y, box_pts):
 
 def get_loudness_smoothed(y, D, sr, hop_length):
     """Smooth out the loudness signal."""
-    n_fft = 2048
-    S = np.abs(librosa.stft(y, n_fft=n_fft, hop_length=hop_length))
+    S = magnitudes(y, D, hop_length)
     power = np.abs(S)**2
     p_mean = np.sum(power, axis=0, keepdims=True)
     p_ref = np.max(power)  # or whatever other reference power you want to use
@@ -113,18 +151,30 @@ def get_loudness_smoothed(y, D, sr, hop_length):
 
 
 def function_listing(name):
-    """List available audio features."""
+    """List available audio features. Normalized features are scaled into
+    [0, 1] which lets them be stored at reduced precision. Features that need
+    samples can't be computed from an stft alone."""
     feature_extraction_fns = {
-        'beats': {'fn': get_beats, 'flavor': 'discrete'},
-        'onsets': {'fn': get_onsets, 'flavor': 'discrete'},
-        'rms': {'fn': get_rms, 'flavor': 'continuous'},
-        'spectral_centroid': {'fn': get_spectral_centroids, 'flavor': 'continuous'},
-        'spectral_flatness': {'fn': get_spectral_flatness, 'flavor': 'continuous'},
-        'zero_crossing_rates': {'fn': get_zero_crossing_rates, 'flavor': 'continuous'},
-        'onset_strength': {'fn': get_onset_strength, 'flavor': 'continuous'},
-        'loudness': {'fn': get_loudness, 'flavor': 'continuous'},
-        'loudness_smoothed': {'fn': get_loudness_smoothed, 'flavor': 'continuous'},
-        'frame_times': {'fn': get_frame_times, 'flavor': 'continuous'},
+        'beats': {'fn': get_beats, 'flavor': 'discrete',
+                  'normalized': False, 'samples': False},
+        'onsets': {'fn': get_onsets, 'flavor': 'discrete',
+                   'normalized': False, 'samples': False},
+        'rms': {'fn': get_rms, 'flavor': 'continuous',
+                'normalized': True, 'samples': False},
+        'spectral_centroid': {'fn': get_spectral_centroids, 'flavor': 'continuous',
+                              'normalized': True, 'samples': False},
+        'spectral_flatness': {'fn': get_spectral_flatness, 'flavor': 'continuous',
+                              'normalized': True, 'samples': False},
+        'zero_crossing_rates': {'fn': get_zero_crossing_rates, 'flavor': 'continuous',
+                                'normalized': True, 'samples': True},
+        'onset_strength': {'fn': get_onset_strength, 'flavor': 'continuous',
+                           'normalized': True, 'samples': False},
+        'loudness': {'fn': get_loudness, 'flavor': 'continuous',
+                     'normalized': True, 'samples': False},
+        'loudness_smoothed': {'fn': get_loudness_smoothed, 'flavor': 'continuous',
+                              'normalized': True, 'samples': False},
+        'frame_times': {'fn': get_frame_times, 'flavor': 'continuous',
+                        'normalized': False, 'samples': False},
     }
     if name not in feature_extraction_fns:
         logging.info("Can't find feature extraction function %s", name)
@@ -132,11 +182,38 @@ def function_listing(name):
     return feature_extraction_fns[name]
 
 
-def generate(store, sig, feature_name):
+def feature_params(plan, sig):
+    """Parameters a feature of a signal depends on."""
+    params = signal_params(plan, sig)
+    params['hop_length'] = plan['metadata']['hop_length']
+    return params
+
+
+def generate(store, sig, feature_name, cache=None):
     """Generate audio feature given feature name."""
-    y = store['signals'][sig]['y']
-    D = store['signals'][sig]['D']
-    sr = store['plan']['metadata']['sr']
-    hop_length = store['plan']['metadata']['hop_length']
-    fn = function_listing(feature_name)['fn']
-    store['signals'][sig]['features'][feature_name] = fn(y, D, sr, hop_length)
+    params = feature_params(store['plan'], sig)
+    if cache is not None:
+        cached = cache.get(sig, 'feature', feature_name, params)
+        if cached is not None:
+            store['signals'][sig]['features'][feature_name] = cached
+            return
+
+    metadata = store['plan']['metadata']
+    s_obj = store['signals'][sig]
+    y = s_obj['y']
+    D = s_obj['D']
+    sr = metadata['sr']
+    hop_length = metadata['hop_length']
+    listing = function_listing(feature_name)
+
+    # stft signals go straight from their stft when they can. One that came
+    # out of the artifact cache as samples gets its stft back first.
+    if stft_signal(sig) and not listing['samples']:
+        if D is None:
+            D = s_obj['D'] = librosa.stft(y, n_fft=metadata['n_fft'],
+                                          hop_length=hop_length)
+        y = None
+    store['signals'][sig]['features'][feature_name] = listing['fn'](y, D, sr, hop_length)
+    if cache is not None:
+        cache.put(sig, 'feature', feature_name, params,
+                  store['signals'][sig]['features'][feature_name])
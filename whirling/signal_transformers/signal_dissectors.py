@@ -4,90 +4,294 @@
 import numpy as np
 import librosa
 import logging
-from spleeter.separator import Separator
+import scipy.signal
+import scipy.ndimage
+from whirling.signal_transformers import audio_features
+from whirling.signal_transformers import signal_params, spleeter_model, \
+    plan_signal_names, DEFAULT_RESAMPLER, BAND_CROSSOVERS_HZ, FAST_HPSS_DECIMATION
 
 
-def generate(track_name: str, store, signal_name: str) -> None:
+# Spleeter separates 512 STFT frames of 1024 samples at a time. Chunks step
+# by a whole number of those segments.
+SPLEETER_SEGMENT = 512 * 1024
 
-    plan = store['plan']
+# Samples separated at a time, about two minutes at the default sr of 22050
+# and one at 44.1 kHz, and how far each chunk runs into the next to be
+# crossfaded with it.
+SPLEETER_CHUNK_STEP = 5 * SPLEETER_SEGMENT
+SPLEETER_OVERLAP = 64 * 1024
 
-    # Load track if not already loaded.
-    if not has_loaded_track(store):
-        load_track_into_store(track_name, plan, store)
+# Separators by model. Loading a model is slow so each is loaded once per
+# process and reused for every track after.
+_separators = {}
 
-    # Get full track signal, D, sr.
-    y = store['signals']['full']['y']
-    D = store['signals']['full']['D']
 
-    # If signal name is full, bail.
-    if signal_name is 'full':
-        return
+def get_separator(model: str):
+    """Get the separator for a spleeter model, loading it on first use.
+    Spleeter is imported here since it brings TensorFlow with it, which only
+    the processes separating tracks should pay for."""
+    if model not in _separators:
+        from spleeter.separator import Separator  # pylint: disable=import-outside-toplevel
+        _separators[model] = Separator(model)
+    return _separators[model]
+
+
+def generate(track_name: str, store, signal_name: str, cache=None) -> None:
+
+    plan = store['plan']
 
     # Bail if we already have some data from this segmentation.
     if already_ran_segmenter(store, signal_name):
         return
 
-    # Segment signals.
-    if signal_name in ["librosa_harmonic", "librosa_percussive"]:
-        segment_harmonics_percussives(store, D)
-    elif signal_name in ['spleeter_' + f for f in ['vocals', 'drums', 'bass', 'other']]:
-        segment_signal_with_spleeter(store, y, track_name)
+    # Grab the signal from the artifact cache if another plan made it.
+    if cache is not None:
+        y = cache.get(signal_name, 'signal', 'y',
+                      signal_params(plan, signal_name))
+        if y is not None:
+            add_signal(store, signal_name, y)
+            return
+
+    # Load track if not already loaded.
+    if not has_loaded_track(store):
+        load_track_into_store(track_name, plan, store, cache)
+
+    # If signal name is full, bail.
+    if signal_name == 'full':
+        return
+
+    # Segment signals with whichever separator makes them.
+    SEPARATORS[separator_of(signal_name)]['fn'](store, track_name, cache)
 
 
 def has_loaded_track(store) -> bool:
     """Determines if the store has the full signal y loaded."""
-    return 'y' in store['signals']['full']
+    return already_ran_segmenter(store, 'full')
 
 
-def load_track_into_store(track_name: str, plan, store) -> None:
-    logging.info('Generating features for track: %s', track_name)
-    sr = plan['metadata']['sr']
-    hop_length = plan['metadata']['hop_length']
-    n_fft = plan['metadata']['n_fft']
-    y, sr = librosa.load(track_name, sr=sr)
-    D = librosa.stft(y, n_fft=n_fft, hop_length=hop_length)
-    store['signals']['full']['y'] = y
-    store['signals']['full']['D'] = D
+def load_track_into_store(track_name: str, plan, store, cache=None) -> None:
+    """Load the full signal from the artifact cache or decode the track. The
+    cached signal is the decoded float32 samples at the plan's sr and gets
+    memory mapped, so plans sharing an sr only ever decode a track once."""
+    y = None
+    metadata = plan['metadata']
+    params = signal_params(plan, 'full')
+    if cache is not None:
+        y = cache.get('full', 'signal', 'y', params)
+
+    if y is None:
+        logging.info('Generating features for track: %s', track_name)
+        y, _sr = librosa.load(track_name, sr=metadata['sr'],
+                              res_type=metadata.get('resampler', DEFAULT_RESAMPLER))
+        y = np.ascontiguousarray(y, dtype=np.float32)
+        cache_signal(cache, 'full', y, params)
+
+    add_signal(store, 'full', y)
 
 
-def segment_harmonics_percussives(store, D):
+def full_spectrogram(store):
+    """Get the full signal's stft, computing it if it isn't around yet."""
+    full = store['signals']['full']
+    if full['D'] is None:
+        metadata = store['plan']['metadata']
+        full['D'] = librosa.stft(
+            full['y'], n_fft=metadata['n_fft'],
+            hop_length=metadata['hop_length'])
+    return full['D']
+
+
+def segment_harmonics_percussives(store, track_name, cache=None):
     """HPSS generates two audio signals. One for the harmonics and the
     other for the percussives."""
+    D = full_spectrogram(store)
     margin = 2
     DH, DP = librosa.decompose.hpss(D, margin=margin)
+    add_hpss_signals(store, 'librosa', DH, DP, cache)
+
+
+def fast_hpss(D, margin=2, kernel_size=31, decimation=FAST_HPSS_DECIMATION):
+    """An approximation of librosa.decompose.hpss. The magnitudes are
+    averaged down by decimation along both axes and median filtered there
+    with a kernel shrunk to match, about decimation cubed times less work.
+    The masks are scaled back up to D's shape and applied to it."""
+    S = np.abs(D)
+    n_bins, n_frames = S.shape
+
+    # Pad the edges out to a whole number of blocks, then average each block.
+    pad_bins, pad_frames = -n_bins % decimation, -n_frames % decimation
+    S = np.pad(S, ((0, pad_bins), (0, pad_frames)), mode='edge')
+    S = S.reshape(S.shape[0] // decimation, decimation,
+                  S.shape[1] // decimation, decimation).mean(axis=(1, 3))
+
+    # Harmonics are steady over time, percussives spread across frequency.
+    kernel = max(1, kernel_size // decimation) | 1
+    H = scipy.ndimage.median_filter(S, size=(1, kernel), mode='reflect')
+    P = scipy.ndimage.median_filter(S, size=(kernel, 1), mode='reflect')
+    mask_H = librosa.util.softmask(H, P * margin, power=2)
+    mask_P = librosa.util.softmask(P, H * margin, power=2)
+
+    def upsample(mask):
+        mask = np.repeat(np.repeat(mask, decimation, axis=0), decimation, axis=1)
+        return mask[:n_bins, :n_frames]
+
+    return D * upsample(mask_H), D * upsample(mask_P)
+
+
+def segment_fast_harmonics_percussives(store, track_name, cache=None):
+    """Like segment_harmonics_percussives but approximate, for building
+    large libraries. See fast_hpss."""
+    DH, DP = fast_hpss(full_spectrogram(store))
+    add_hpss_signals(store, 'fast', DH, DP, cache)
+
 
-    # Add segmented signals to the store.
-    add_signal(store, 'librosa_harmonic', librosa.istft(DH), DH)
-    add_signal(store, 'librosa_percussive', librosa.istft(DP), DP)
+def add_hpss_signals(store, prefix, DH, DP, cache=None):
+    """Add the harmonic and percussive signals of an HPSS to the store. Their
+    stfts are kept as is. Samples are only synthesized, with the plan's
+    window, for signals being saved or with features that need samples."""
+    metadata = store['plan']['metadata']
+    length = len(store['signals']['full']['y'])
+    requested = plan_signal_names(store['plan'])
 
+    synthesized = []
+    for signal_name, D in [(f'{prefix}_harmonic', DH), (f'{prefix}_percussive', DP)]:
+        y = None
+        features = store['signals'][signal_name].get('features', {})
+        if signal_name in requested and needs_samples(metadata, features):
+            y = librosa.istft(D, hop_length=metadata['hop_length'],
+                              win_length=metadata['n_fft'], length=length)
+            synthesized.append(signal_name)
+        add_signal(store, signal_name, y, D)
+    cache_signals(store, cache, synthesized)
 
-def segment_signal_with_spleeter(store, y, track_name):
-    """Use spleeter to separate the track into 4 components:
-    Vocals, Drums, base, other separation"""
 
-    # Slap two monotone signals to make a stereo signal.
-    y_new = np.array([y, y]).T
+def needs_samples(metadata, features) -> bool:
+    """Whether an stft signal with these features has to be synthesized. It
+    does when signals are saved or a feature needs samples."""
+    if metadata.get('save_signals', True):
+        return True
+    return any(audio_features.function_listing(f)['samples'] for f in features)
 
-    separator = Separator('spleeter:4stems')
-    prediction = separator.separate(y_new, track_name)
 
-    other = np.ascontiguousarray(prediction['other'][:, 0], dtype=np.float32)
-    drums = np.ascontiguousarray(prediction['drums'][:, 0], dtype=np.float32)
-    bass = np.ascontiguousarray(prediction['bass'][:, 0], dtype=np.float32)
-    vocals = np.ascontiguousarray(prediction['vocals'][:, 0], dtype=np.float32)
+def spleeter_stem(prediction, stem: str):
+    """One channel of a stem from a spleeter prediction. 4stems doesn't make
+    an accompaniment, it's the sum of the stems besides the vocals."""
+    if stem in prediction:
+        return prediction[stem][:, 0]
+    return sum(prediction[s][:, 0] for s in ['drums', 'bass', 'other'])
+
+
+def segment_signal_with_spleeter(store, track_name, cache=None):
+    """Use spleeter to separate the track into the stems the plan asks for.
+    The 2stems model makes vocals and accompaniment at about half the cost
+    of 4stems, which makes vocals, drums, bass and other. The cheaper one is
+    used whenever it covers the plan. Stems nobody asked for are dropped a
+    chunk at a time and never kept whole.
+
+    The track is separated a chunk at a time and each chunk's stems are
+    written straight into their arrays, memory mapped artifact files when
+    there's a cache. Memory stays the same however long the track is. See
+    separate_in_chunks for how the result differs from separating the whole
+    track at once."""
+    plan = store['plan']
+    y = store['signals']['full']['y']
+    separator = get_separator(spleeter_model(plan))
+    n = len(y)
+
+    stems = {}
+    try:
+        for signal_name in sorted(plan_signal_names(plan)):
+            if not signal_name.startswith('spleeter_') or \
+                    already_ran_segmenter(store, signal_name):
+                continue
+            stem = signal_name[len('spleeter_'):]
+            if cache is not None:
+                stems[stem] = cache.create(signal_name, 'signal', 'y',
+                                           signal_params(plan, signal_name), (n,))
+            else:
+                stems[stem] = np.empty(n, dtype=np.float32)
+
+        separate_in_chunks(separator, y, stems, track_name)
+
+        # Add segmented signals to the store. They're in the cache already.
+        for stem, out in stems.items():
+            signal_name = 'spleeter_' + stem
+            if cache is not None:
+                out = cache.commit(signal_name, 'signal', 'y',
+                                   signal_params(plan, signal_name), out)
+            add_signal(store, signal_name, out)
+    finally:
+        # Temp files of stems that never got committed.
+        if cache is not None:
+            for out in stems.values():
+                cache.discard(out)
+
+
+def separate_in_chunks(separator, y, stems, track_name: str = '') -> None:
+    """Separate y with spleeter a chunk at a time into stems, a dict of
+    stem name to float32 arrays as long as y.
+
+    This isn't the same as separating the whole track at once. Every chunk
+    is padded on its own and spleeter's 512 frame segments fall differently
+    within it, so differences reach past the overlaps, where one chunk's end
+    is crossfaded linearly into the next one's start. How far apart the two
+    come out hasn't been measured, so there's no known tolerance between
+    chunked stems and whole track ones."""
+    n = len(y)
+    fade_in = np.linspace(0, 1, SPLEETER_OVERLAP, dtype=np.float32)
+    for start in range(0, n, SPLEETER_CHUNK_STEP):
+        end = min(n, start + SPLEETER_CHUNK_STEP + SPLEETER_OVERLAP)
+
+        # Slap two monotone signals to make a stereo signal.
+        chunk = y[start:end]
+        prediction = separator.separate(np.stack([chunk, chunk], axis=1), track_name)
+
+        for stem, out in stems.items():
+            separated = np.asarray(spleeter_stem(prediction, stem)[:end - start],
+                                   dtype=np.float32)
+            if start > 0:
+                fade = min(SPLEETER_OVERLAP, end - start)
+                w = fade_in[:fade]
+                separated[:fade] = out[start:start + fade] * (1 - w) + separated[:fade] * w
+            out[start:end] = separated
+
+
+def split_bands(store, track_name, cache=None):
+    """Split the track into low, mid and high bands with a filterbank. It's
+    nowhere near a source separation but it's close to free, which makes it
+    a stand in for spleeter where time matters more than quality. The mid
+    band is whatever the other two leave so the bands add back up to the
+    track exactly."""
+    plan = store['plan']
+    y = store['signals']['full']['y']
+    sr = plan['metadata']['sr']
+    low_hz, high_hz = BAND_CROSSOVERS_HZ
+
+    bands = {}
+    requested = plan_signal_names(plan)
+    low = scipy.signal.sosfiltfilt(
+        scipy.signal.butter(4, low_hz, 'lowpass', fs=sr, output='sos'), y)
+    high = scipy.signal.sosfiltfilt(
+        scipy.signal.butter(4, high_hz, 'highpass', fs=sr, output='sos'), y)
+    if 'bands_mid' in requested:
+        bands['bands_mid'] = y - low - high
+    bands['bands_low'] = low
+    bands['bands_high'] = high
+
+    # Only the bands asked for are kept.
+    signal_names = [s for s in bands if s in requested]
+    for signal_name in signal_names:
+        add_signal(store, signal_name,
+                   np.ascontiguousarray(bands[signal_name], dtype=np.float32))
+    cache_signals(store, cache, signal_names)
 
-    # Add segmented signals to the store.
-    add_signal(store, 'spleeter_other', other)
-    add_signal(store, 'spleeter_drums', drums)
-    add_signal(store, 'spleeter_bass', bass)
-    add_signal(store, 'spleeter_vocals', vocals)
 
 def already_ran_segmenter(store, signal_name: str) -> bool:
     """Return wether or not the store has any separated signal data."""
     if signal_name not in store['signals']:
         return False
 
-    return 'y' in store['signals'][signal_name]
+    s_obj = store['signals'][signal_name]
+    return s_obj.get('y') is not None or s_obj.get('D') is not None
 
 def add_signal(store, signal_name, y, D=None):
     """Add signal to store."""
@@ -98,3 +302,73 @@ def add_signal(store, signal_name, y, D=None):
         }
     store['signals'][signal_name]['y'] = y
     store['signals'][signal_name]['D'] = D
+
+
+def cache_signal(cache, signal_name, y, params) -> None:
+    """Put a signal into the artifact cache if there is one."""
+    if cache is not None:
+        cache.put(signal_name, 'signal', 'y', params, y)
+
+
+def cache_signals(store, cache, signal_names) -> None:
+    """Put freshly separated signals into the artifact cache. Only the ones
+    given are cached, which is what the plan asked for, so a plan wanting
+    another stem later separates the track again."""
+    for signal_name in signal_names:
+        cache_signal(cache, signal_name, store['signals'][signal_name]['y'],
+                     signal_params(store['plan'], signal_name))
+
+
+###############################################################################
+# Separator backends.
+###############################################################################
+
+# Every separator a plan's signals can come from, by name. A separator makes
+# all of its signals a plan asks for in one go. Cost is CPU seconds and
+# memory_mb is MB of memory per second of audio, both rough defaults until
+# builds have been timed and measured. Separators cache the signals the plan
+# asked for, HPSS only the ones it synthesizes samples for.
+SEPARATORS = {
+    'full': {
+        'signals': ['full'],
+        'fn': None,
+        'cost': 0.02,
+        'memory_mb': 1.5
+    },
+    'librosa': {
+        'signals': ['librosa_harmonic', 'librosa_percussive'],
+        'fn': segment_harmonics_percussives,
+        'cost': 0.15,
+        'memory_mb': 3.0
+    },
+    'fast': {
+        'signals': ['fast_harmonic', 'fast_percussive'],
+        'fn': segment_fast_harmonics_percussives,
+        'cost': 0.03,
+        'memory_mb': 3.0
+    },
+    'spleeter': {
+        'signals': ['spleeter_vocals', 'spleeter_accompaniment', 'spleeter_bass',
+                    'spleeter_drums', 'spleeter_other'],
+        'fn': segment_signal_with_spleeter,
+        'cost': 0.3,
+        'memory_mb': 2.0
+    },
+    'bands': {
+        'signals': ['bands_low', 'bands_mid', 'bands_high'],
+        'fn': split_bands,
+        'cost': 0.01,
+        'memory_mb': 1.0
+    }
+}
+
+# What are the valid signals that can be defined in a plan.
+VALID_SIGNALS = [s for separator in SEPARATORS.values() for s in separator['signals']]
+
+
+def separator_of(signal_name: str) -> str:
+    """The name of the separator a signal comes from."""
+    for name, separator in SEPARATORS.items():
+        if signal_name in separator['signals']:
+            return name
+    raise ValueError(f"Can't find a separator for signal {signal_name}")
@@ -5,6 +5,7 @@ import math
 import numpy as np
 import librosa
 from schema import Schema, Optional
+from whirling.signal_transformers import signal_params
 
 
 SPECTROGRAM_SCHEMA = Schema({
@@ -12,13 +13,35 @@ SPECTROGRAM_SCHEMA = Schema({
     Optional('custom_log_db'): bool,
 })
 
+# The dB range of the custom log db spectrogram. amplitude_to_db clips to
+# 80 dB below the max which is also where the visualizers clip.
+LOG_DB_RANGE = (-80.0, 0.0)
 
-def generate(store, sig, spectrogram_name):
+
+def spectrogram_params(plan, sig):
+    """Parameters a spectrogram of a signal depends on."""
+    metadata = plan['metadata']
+    params = signal_params(plan, sig)
+    params['n_fft'] = metadata['n_fft']
+    params['hop_length'] = metadata['hop_length']
+    return params
+
+
+def generate(store, sig, spectrogram_name, cache=None):
     """Generates standard spectrogram and any specified variant."""
-    hop_length = store['plan']['metadata']['hop_length']
-    n_fft = store['plan']['metadata']['n_fft']
+    metadata = store['plan']['metadata']
+    hop_length = metadata['hop_length']
+    n_fft = metadata['n_fft']
     y = store['signals'][sig]['y']
 
+    # Variants are cached. The standard spectrogram is too big to be worth it.
+    params = spectrogram_params(store['plan'], sig)
+    if cache is not None and spectrogram_name != 'standard':
+        cached = cache.get(sig, 'spectrogram', spectrogram_name, params)
+        if cached is not None:
+            store['signals'][sig]['spectrograms'][spectrogram_name] = cached
+            return
+
     # Check if spectrogram is created already.
     if 'D' not in store['signals'][sig] or store['signals'][sig]['D'] is None:
         store['signals'][sig]['D'] = standard_spectrogram(y, n_fft, hop_length)
@@ -28,6 +51,9 @@ def generate(store, sig, spectrogram_name):
     if spectrogram_name == 'custom_log_db':
         store['signals'][sig]['spectrograms'][spectrogram_name] = \
             log_db_spectrogram(D)
+        if cache is not None:
+            cache.put(sig, 'spectrogram', spectrogram_name, params,
+                      store['signals'][sig]['spectrograms'][spectrogram_name])
 
 
 def standard_spectrogram(y, n_fft, hop_length):
@@ -42,11 +68,17 @@ def log_db_spectrogram(D):
     Each chunk of frequency bins then gets there values averaged.
     """
     db_s = librosa.amplitude_to_db(np.abs(D), ref=np.max)
-    max_power = int(math.log(db_s.shape[0] - 1, 2))
-    idxs = [(int(math.pow(2, (i-1)/12)), int(math.pow(2, i/12))) for i in range(max_power*12 + 1)
-            if int(math.pow(2, (i-1)/12)) != int(math.pow(2, i/12))]
+    idxs = log_db_bands(db_s.shape[0])
     log_db_s = np.array([
         [np.average(db_s[idx1: idx2, j]) for idx1, idx2 in idxs]
         for j in range(db_s.shape[1])
     ])
-    return log_db_s
\ No newline at end of file
+    return log_db_s
+
+
+def log_db_bands(n_bins):
+    """The frequency bin ranges the log db spectrogram averages over. There
+    are 12 per octave, minus the ones too narrow to hold a bin."""
+    max_power = int(math.log(n_bins - 1, 2))
+    return [(int(math.pow(2, (i-1)/12)), int(math.pow(2, i/12))) for i in range(max_power*12 + 1)
+            if int(math.pow(2, (i-1)/12)) != int(math.pow(2, i/12))]
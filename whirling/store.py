@@ -5,17 +5,105 @@ visualization needs.
 """
 
 import os
+import copy
+import glob
 import json
-import pickle
+import time
 import logging
+from collections import namedtuple
 from typing import List
 import pkg_resources  # part of setuptools
 from rx.subject.behaviorsubject import BehaviorSubject
 from schema import Schema, And, Optional
-from whirling.signal_transformers import VALID_SIGNALS
+from whirling.signal_transformers import RESAMPLERS, signal_params
 from whirling.signal_transformers import audio_features
 from whirling.signal_transformers import spectrogram_variants
 from whirling.signal_transformers import signal_dissectors
+from whirling.cache import dnz, plan_output_nbytes
+from whirling.cache import keys
+from whirling.cache.artifacts import ArtifactCache
+from whirling.cache.lru import PlanOutputLRU, DEFAULT_LRU_BUDGET
+from whirling.track_loader import TrackLoader, DEFAULT_PREFETCH_BUDGET
+from whirling.tools.process_memory import peak_rss_mb, reset_peak_rss
+
+
+# Where dnz files are kept. They're named by content so they can't live along
+# side the tracks anymore.
+CACHE_DIR = 'data/cache'
+
+# How precisely dnz files store spectrograms and features.
+# full: as generated.
+# reduced: normalized features as float16 and log db spectrograms as uint8.
+STORAGE_PRECISIONS = ['full', 'reduced']
+
+# How often, in seconds, to check the plan file for changes when watching it.
+PLAN_WATCH_INTERVAL = 1.0
+
+# Stages of building a plan output, in the order they finish. Stages a plan
+# needs nothing from are reported as skipped.
+BUILD_STAGES = ['decode', 'separate', 'stft', 'spectrograms', 'features', 'write']
+
+# Published while a track loads. Fraction goes from 0 to 1.
+LoadProgress = namedtuple('LoadProgress', ['track', 'stage', 'fraction'])
+
+
+def step_kind(key) -> str:
+    """What a build step computes, without the signal it's computed on.
+    Signals go by their separator."""
+    if key[0] == 'signal':
+        return signal_dissectors.separator_of(key[1])
+    return key[2]
+
+
+class PlanBuild():
+    """A plan output being generated and the steps left to generate it.
+    Steps are (progress label, key, function, args)."""
+
+    def __init__(self, track_name: str, plan_output, steps, requested):
+        self.track_name = track_name
+        self.plan_output = plan_output
+        self.steps = steps
+
+        # Signals the plan asked for. Separators can make others.
+        self.requested = requested
+
+        # A stage starts with its first step and is done after its last.
+        self.stages = [Store.step_stage(key) for _stage, key, _fn, _args in steps]
+        self.first_steps = {}
+        self.last_steps = {}
+        for i, stage in enumerate(self.stages):
+            self.first_steps.setdefault(stage, i)
+            self.last_steps[stage] = i
+
+        self.last_uses = {}
+        self.cache: ArtifactCache = None
+
+        # How many array bytes were in memory with and without releasing.
+        self.peak = 0
+        self.released = 0
+        self.peak_unreleased = 0
+
+        # Time and peak process memory by stage, with time broken down by
+        # step kind. Handed to the stage listener as each stage finishes.
+        self.stage_profiles = {}
+
+    def record_step(self, i: int, seconds: float, peak_mb: float = None) -> None:
+        """Add a finished step to its stage's profile. Steps are grouped by
+        separator for signals and by name for spectrograms and features. A
+        separator runs once however many of its signals are asked for, so
+        it's counted once. Steps that weren't measured have no peak."""
+        _stage, key, _fn, _args = self.steps[i]
+        kind = step_kind(key)
+        profile = self.stage_profiles.setdefault(self.stages[i], {
+            'seconds': 0.0, 'steps': {}, 'counts': {}})
+        profile['seconds'] += seconds
+        if peak_mb is not None:
+            profile['peak_rss_mb'] = max(profile.get('peak_rss_mb', 0.0), peak_mb)
+        profile['steps'][kind] = profile['steps'].get(kind, 0.0) + seconds
+        if key[0] == 'signal':
+            profile['counts'][kind] = 1
+        else:
+            profile['counts'][kind] = profile['counts'].get(kind, 0) + 1
 
 
 class Store():
@@ -40,20 +128,76 @@ class Store():
             # Declare what variables this store intends to have.
             self.current_track_bs: BehaviorSubject = None
             self.current_visualizer_bs: BehaviorSubject = None
+            self.active_plan_bs: BehaviorSubject = None
             self.is_plan_loaded_bs: BehaviorSubject = None
+            self.load_progress_bs: BehaviorSubject = None
             self.plan_name: str = None
             self.use_cache: bool = None
+            self.blast_artifacts: bool = False
+            self.blasted_tracks = set()
+            self.track_loader: TrackLoader = None
+            self.prefetch_previous: bool = False
+            self.prefetch_generate: bool = False
+
+            # Whether build steps reset the process's peak memory to measure
+            # their own. Only safe while one thread builds at a time.
+            self.measure_step_peaks: bool = True
+
+            # Called as (track, stage, state, detail) while building plan
+            # outputs, like by the cache builder's manifest.
+            self.stage_listener = None
+
+            # Recently used plan outputs so flipping between tracks skips disk.
+            self.lru: PlanOutputLRU = None
+            self.cache_dir: str = CACHE_DIR
+
+            # The plan as read from disk and its content hash.
+            self.active_plan = None
+            self.plan_hash: str = None
+            self.audio_hashes: keys.AudioHashIndex = None
+
+            # Plan file watching for hot reloads.
+            self.watch_plan: bool = False
+            self.plan_mtime: float = None
+            self.last_plan_check: float = 0
 
             # The plan output contains the output from processing the plan.
             self.plan_output = None
 
-    def initialize(self, plan_name: str, use_cache: bool):
-        """Setup store"""
-        self.plan_name = plan_name
+    def initialize(self, plan_name: str, use_cache: bool,
+                   async_loading: bool = False,
+                   prefetch_budget: int = DEFAULT_PREFETCH_BUDGET,
+                   prefetch_previous: bool = False,
+                   prefetch_generate: bool = False,
+                   lru_budget: int = DEFAULT_LRU_BUDGET,
+                   watch_plan: bool = False,
+                   blast_artifacts: bool = False):
+        """Setup store. With async loading, tracks are loaded on a background
+        thread and handed over when the main loop calls update. Neighboring
+        tracks are then prefetched within prefetch_budget bytes, generating
+        them too with prefetch_generate. Recently
+        used plan outputs are kept in memory up to lru_budget bytes. Watching
+        the plan applies edits to it live. Blasting artifacts throws out each
+        track's artifact cache the first time it's generated, so everything
+        is recomputed."""
         self.use_cache = use_cache
+        self.blast_artifacts = blast_artifacts
+        self.prefetch_previous = prefetch_previous
+        self.prefetch_generate = prefetch_generate
+        self.watch_plan = watch_plan
+        self.lru = PlanOutputLRU(lru_budget)
+        if async_loading:
+            self.track_loader = TrackLoader(self.load_plan_output, prefetch_budget,
+                                            prefetch_generate)
+
+        # Load plan up front since it's part of every cache key.
+        self.use_plan(plan_name)
+        self.audio_hashes = keys.AudioHashIndex(self.cache_dir)
 
         # Initialize behavior subjects.
+        self.active_plan_bs = BehaviorSubject(self.active_plan)
         self.is_plan_loaded_bs = BehaviorSubject(False)
+        self.load_progress_bs = BehaviorSubject(LoadProgress('', '', 0))
         self.current_track_bs = BehaviorSubject('')
         self.current_track_bs.subscribe(self.on_track_change)
         self.current_visualizer_bs = BehaviorSubject('')
@@ -71,17 +215,121 @@ class Store():
         if new_track == '':
             return
 
-        exist = self.store_cache_exists(new_track)
-
-        if not exist or not self.use_cache:
-            self.generate_plan_output(new_track)
-            self.save_store(new_track, self.plan_output)
+        # Recently played tracks are still in memory. With a loader, a track
+        # that hasn't been hashed yet can't be in there and gets hashed on
+        # the loader's thread instead of holding up this one.
+        if self.track_loader is None or self.audio_hashes.known_hash(new_track):
+            plan_output = self.lru.get(self.store_file_name(new_track))
         else:
-            self.plan_output = self.load_store(new_track)
+            plan_output = None
+        logging.debug('Plan output LRU: %s', self.lru.stats())
+        if plan_output is not None:
+            # Plans only differing in visualizer settings share entries.
+            if plan_output['plan'] != self.active_plan:
+                plan_output = dict(plan_output, plan=copy.deepcopy(self.active_plan))
+            self.plan_output = plan_output
+            self.is_plan_loaded_bs.on_next(True)
+            return
+
+        # Hand off to the loader, update will pick the result up.
+        if self.track_loader is not None:
+            self.track_loader.load(new_track, self.active_plan)
+            return
+
+        self.plan_output = self.load_plan_output(new_track)
+        self.lru.put(self.store_file_name(new_track), self.plan_output)
 
         # Notify others the plan is loaded.
         self.is_plan_loaded_bs.on_next(True)
 
+    def update(self):
+        """Collect plan outputs the track loader finished and check for plan
+        edits. Meant to be called from the main loop so subscribers are
+        notified on that thread."""
+        if self.watch_plan and time.time() - self.last_plan_check > PLAN_WATCH_INTERVAL:
+            self.last_plan_check = time.time()
+            self.reload_plan_if_changed()
+
+        if self.track_loader is None:
+            return
+
+        for track_name, plan_output in self.track_loader.poll():
+            # Drop loads for tracks the user has already skipped past or that
+            # were made from a plan that has since been edited.
+            if track_name != self.current_track_bs.value or \
+                    plan_output['plan'] != self.active_plan:
+                continue
+            self.plan_output = plan_output
+            self.lru.put(self.store_file_name(track_name), plan_output)
+            self.is_plan_loaded_bs.on_next(True)
+
+    def load_plan_output(self, track_name, plan=None, generate=True):
+        """Load the cached plan output for a track with a plan, the active one
+        by default, or generate it. Without generate, None is returned when
+        it isn't cached. Doesn't touch the current plan output so it's safe
+        to call off thread. The active plan is read once up front so a reload
+        mid load can't mix plans."""
+        plan = plan or self.active_plan
+        self.report_progress(track_name, 'Loading', 0)
+
+        plan_output = None
+        dnz_name = self.store_file_name(track_name, self.plan_hash_of(plan))
+        if self.use_cache and os.path.exists(dnz_name):
+            try:
+                plan_output = self.load_store(track_name, plan)
+            except dnz.DnzError as e:
+                # Regenerating pulls everything still intact out of the
+                # artifact cache, so only what's missing gets recomputed.
+                logging.warning('Rebuilding bad cache entry: %s', e)
+
+        if plan_output is None:
+            if not generate:
+                return None
+            if self.blast_artifacts and track_name not in self.blasted_tracks:
+                self.purge_artifacts(track_name)
+                self.blasted_tracks.add(track_name)
+            plan_output = self.generate_plan_output(track_name, plan)
+            self.write_plan_output(track_name, plan_output)
+
+        self.report_progress(track_name, 'Loaded', 1)
+        return plan_output
+
+    def write_plan_output(self, track_name, plan_output):
+        """Save a freshly generated plan output as the track's dnz file."""
+        self.report_progress(track_name, 'Saving', 1)
+        self.report_stage(track_name, 'write', 'started')
+        if self.measure_step_peaks:
+            reset_peak_rss()
+        start = time.perf_counter()
+        self.save_store(track_name, plan_output)
+        detail = {'seconds': time.perf_counter() - start}
+        if self.measure_step_peaks:
+            detail['peak_rss_mb'] = peak_rss_mb()
+        self.report_stage(track_name, 'write', 'done', detail)
+
+    def prefetch_tracks(self, track_names: List[str]):
+        """Load the plan output for tracks likely to be played next so
+        switching to them is instant. Tracks that aren't cached yet are left
+        for when they're played unless prefetches generate."""
+        if self.track_loader is None:
+            return
+        current_track = self.current_track_bs.value
+        self.track_loader.prefetch([t for t in track_names if t != current_track],
+                                   self.active_plan)
+
+    def report_progress(self, track_name, stage, fraction):
+        """Publish load progress. Prefetches don't report since the loading
+        screen only cares about the current track."""
+        if track_name != self.current_track_bs.value:
+            return
+        self.load_progress_bs.on_next(LoadProgress(track_name, stage, fraction))
+
+    def report_stage(self, track_name, stage, state, detail=None):
+        """Tell the stage listener, if there is one, a build stage of a track
+        started, finished or was skipped."""
+        if self.stage_listener is not None:
+            self.stage_listener(track_name, stage, state, detail)
+
     @property
     def plan(self):
         """Grab plan from dnz output."""
@@ -134,16 +382,71 @@ class Store():
                     signal_spectrograms[s].update(spectrograms)
         return signal_spectrograms
 
+    @property
+    def plan_file_name(self) -> str:
+        """Where the active plan lives."""
+        return f'plans/{self.plan_name}.json'
+
+    def use_plan(self, plan_name: str):
+        """Load, validate and activate a plan. Subscribers of the active plan
+        are told if there are any yet."""
+        self.plan_name = plan_name
+        self.plan_mtime = os.path.getmtime(self.plan_file_name)
+        self.active_plan = self.load_plan()
+        self.validate_plan(self.active_plan)
+        self.plan_hash = self.plan_hash_of(self.active_plan)
+        if self.active_plan_bs is not None:
+            self.active_plan_bs.on_next(self.active_plan)
+
     def load_plan(self):
         """Generate the plan output aka dnz (dance) file from the plan."""
-        full_plan_loc = f'plans/{self.plan_name}.json'
+        full_plan_loc = self.plan_file_name
         if not os.path.exists(full_plan_loc):
             logging.error('Couldn\'t find plan %s', full_plan_loc)
             quit()
-        with open(full_plan_loc, 'r') as f:
+        with open(full_plan_loc, 'r', encoding='utf-8') as f:
             return json.load(f)
 
-    def validate_plan(self):
+    def reload_plan_if_changed(self):
+        """Reload the plan if its file changed. The current track is rebuilt
+        from its existing output so only what the edit added is computed.
+        Broken edits are logged and the old plan stays active."""
+        try:
+            mtime = os.path.getmtime(self.plan_file_name)
+        except OSError:
+            return
+        if mtime == self.plan_mtime:
+            return
+        self.plan_mtime = mtime
+
+        try:
+            with open(self.plan_file_name, 'r', encoding='utf-8') as f:
+                plan = json.load(f)
+            self.validate_plan(plan)
+        except Exception as e:  # pylint: disable=broad-except
+            logging.error('Ignoring edit to plan %s: %s', self.plan_name, e)
+            return
+
+        if plan == self.active_plan:
+            return
+        logging.info('Reloading plan %s.', self.plan_name)
+        self.active_plan = plan
+        self.plan_hash = self.plan_hash_of(plan)
+        if self.track_loader is not None:
+            self.track_loader.clear_prefetched()
+
+        # The old output goes before anyone sees the new plan, visualizers
+        # the edit added have nothing in it.
+        self.is_plan_loaded_bs.on_next(False)
+        self.plan_output = None
+        self.active_plan_bs.on_next(plan)
+        self.on_track_change(self.current_track_bs.value)
+
+    def plan_hash_of(self, plan) -> str:
+        """Hash the parts of a plan that affect generated data."""
+        return keys.plan_hash(plan['metadata'], self.merge_plan_signal_defs(plan))
+
+    def validate_plan(self, plan):
         """Using the schema package, validate the basics for a plan.
         Each individual visualizer will finish checking the plan respectively
         for their specific settings."""
@@ -157,13 +460,16 @@ class Store():
                     "sr": int,
                     "hop_length": int,
                     "n_fft": int,
-                    Optional("save_signals"): bool
+                    Optional("save_signals"): bool,
+                    Optional("storage_precision"): And(
+                        str, lambda p: p in STORAGE_PRECISIONS),
+                    Optional("resampler"): And(str, lambda r: r in RESAMPLERS)
                 },
                 "visualizers": {
                     And(str, lambda n: n in [v[0] for v in VISUALIZERS]): {
                         "settings": dict,
                         "signals": {
-                            And(str, lambda n: n in VALID_SIGNALS): {
+                            And(str, lambda n: n in signal_dissectors.VALID_SIGNALS): {
                                 Optional('spectrograms'): spectrogram_variants.SPECTROGRAM_SCHEMA,
                                 Optional('features'): audio_features.FEATURES_SCHEMA,
                             }
@@ -172,15 +478,15 @@ class Store():
                 }
             }
         )
-        schema.validate(self.plan)
+        schema.validate(plan)
 
-    def merge_plan_signal_defs(self):
+    def merge_plan_signal_defs(self, plan):
         """Merge the signal json blobs of all plan visualizers.
         This makes data generation much easier down the road by not repeating
         work. Each visualizer can then access the plan and get the necessary
         data to render."""
         merged = {}
-        for _, v_obj in self.plan['visualizers'].items():
+        for _, v_obj in plan['visualizers'].items():
             for sig_name, s_obj in v_obj['signals'].items():
                 if sig_name not in merged:
                     merged[sig_name] = {}
@@ -200,55 +506,300 @@ class Store():
                             merged[sig_name]['spectrograms'][s] = None
         return {'signals': merged}
 
-    def generate_plan_output(self, track_name):
-        """Generates store data from """
-        self.plan_output = {
-            'plan': self.load_plan()
+    def generate_plan_output(self, track_name, plan=None):
+        """Generates store data from a plan, the active one by default, and
+        returns it. If the track has a dnz file from an earlier version of
+        the plan, everything the two have in common is carried over and only
+        the difference is computed. Nothing is carried over when the cache is
+        bypassed or blasted."""
+        build = self.prepare_build(track_name, plan)
+        self.run_build_steps(build)
+        return self.finish_build(build)
+
+    def prepare_build(self, track_name, plan=None, stage_order=None) -> PlanBuild:
+        """Lay out the steps of generating a plan output. By default each
+        signal's spectrograms and features run right after it's separated
+        so it can be released before the next one is made. Given a stage
+        order, steps are grouped by stage instead so the stages can run
+        apart from each other."""
+        plan_output = {
+            'plan': copy.deepcopy(plan or self.active_plan)
         }
-        self.validate_plan()
-        merged_signal_data_defs = self.merge_plan_signal_defs()
-        self.plan_output.update(merged_signal_data_defs)
-
-        # Generate signals
-        sigs = self.signals
-        for sig_name in sigs:
-            signal_dissectors.generate(track_name, self.plan_output, sig_name)
-
-        # Generate spectrogram.
-        for sig, spectrograms in self.signal_spectrograms.items():
-            for s in spectrograms:
-                spectrogram_variants.generate(self.plan_output, sig, s)
-
-        # Generate features.
-        for sig, features in self.signal_features.items():
-            for f in features:
-                audio_features.generate(self.plan_output, sig, f)
-
-    def store_file_name(self, track_name: str) -> str:
-        """Constructs store file name from track name"""
-        return f'{os.path.splitext(track_name)[0]}_{self.plan_name}.p'
-
-    def store_cache_exists(self, track_name: str) -> bool:
-        """Checks if cache exists for the combination of plan and track name."""
-        pickle_name = self.store_file_name(track_name)
-        return os.path.exists(pickle_name)
+        merged_signal_data_defs = self.merge_plan_signal_defs(plan_output['plan'])
+        plan_output.update(merged_signal_data_defs)
+        merged = merged_signal_data_defs['signals']
+
+        # Carry over outputs from an earlier plan.
+        carried = set()
+        base_name = None
+        if self.use_cache and not self.blast_artifacts:
+            base_name = self.find_base_store(track_name, plan_output['plan'])
+        if base_name is not None:
+            carried = self.carry_over_outputs(plan_output, dnz.load_dnz(base_name))
+            logging.info('Reusing %d outputs from %s.', len(carried), base_name)
+
+        # Lay out every step up front so progress can be reported.
+        save_signals = plan_output['plan']['metadata'].get('save_signals', True)
+        steps = []
+        # A separator makes all its signals in one run so they're kept
+        # together, cheapest separator first after the full signal.
+        for sig_name in sorted(merged, key=self.separation_order):
+            s_obj = merged[sig_name]
+            steps.append((f'Separating {sig_name}', ('signal', sig_name),
+                          signal_dissectors.generate,
+                          (track_name, plan_output, sig_name)))
+            for s in s_obj.get('spectrograms', {}):
+                steps.append((f'Spectrogram {sig_name} {s}', ('spectrograms', sig_name, s),
+                              spectrogram_variants.generate,
+                              (plan_output, sig_name, s)))
+            for f in s_obj.get('features', {}):
+                steps.append((f'Feature {sig_name} {f}', ('features', sig_name, f),
+                              audio_features.generate,
+                              (plan_output, sig_name, f)))
+        steps = [step for step in steps if step[1] not in carried]
+        if stage_order is not None:
+            steps.sort(key=lambda step: stage_order.index(self.step_stage(step[1])))
+
+        # Signals nothing left to compute depends on don't need separating.
+        needed = set(key[1] for _stage, key, _fn, _args in steps if key[0] != 'signal')
+        if needed - {'full'}:
+            needed.add('full')
+        if not save_signals:
+            steps = [step for step in steps
+                     if step[1][0] != 'signal' or step[1][1] in needed]
+
+        build = PlanBuild(track_name, plan_output, steps, set(merged))
+        build.last_uses = self.signal_last_uses(steps)
+        for stage in BUILD_STAGES[:-1]:
+            if stage not in build.first_steps:
+                self.report_stage(track_name, stage, 'skipped')
+
+        # Every step checks the per artifact cache before computing so work
+        # done for other plans is reused.
+        build.cache = self.artifact_cache(track_name)
+        return build
+
+    def run_build_steps(self, build: PlanBuild, stages=None) -> None:
+        """Run the steps of a build in the given stages, all by default.
+        Signals are released after their last use."""
+        plan_output = build.plan_output
+        save_signals = plan_output['plan']['metadata'].get('save_signals', True)
+        for i, (stage, _key, fn, args) in enumerate(build.steps):
+            if stages is not None and build.stages[i] not in stages:
+                continue
+            self.report_progress(build.track_name, stage, i / len(build.steps))
+            if build.first_steps[build.stages[i]] == i:
+                self.report_stage(build.track_name, build.stages[i], 'started')
+            if self.measure_step_peaks:
+                reset_peak_rss()
+            start = time.perf_counter()
+            fn(*args, build.cache)
+            build.record_step(i, time.perf_counter() - start,
+                              peak_rss_mb() if self.measure_step_peaks else None)
+
+            in_memory = plan_output_nbytes(plan_output, resident_only=True)
+            build.peak = max(build.peak, in_memory)
+            build.peak_unreleased = max(build.peak_unreleased, in_memory + build.released)
+            # Separators can make stems the plan never asked for too. The full
+            # signal is the exception, separators read it until its last use.
+            to_release = build.last_uses.get(i, []) + [
+                s for s in plan_output['signals']
+                if s not in build.requested and s != 'full']
+            for sig_name in to_release:
+                build.released += self.release_signal(plan_output, sig_name, save_signals)
+            if build.last_steps[build.stages[i]] == i:
+                self.report_stage(build.track_name, build.stages[i], 'done',
+                                  build.stage_profiles[build.stages[i]])
+
+    def finish_build(self, build: PlanBuild):
+        """Log how much memory a build took and return its plan output."""
+        logging.info('Peak plan output memory for %s: %.1f MB, %.1f MB if '
+                     'signals were kept.', build.track_name, build.peak / 1e6,
+                     build.peak_unreleased / 1e6)
+        return build.plan_output
+
+    @staticmethod
+    def separation_order(sig_name):
+        """Sort key putting signals in the order they're separated."""
+        separator = signal_dissectors.separator_of(sig_name)
+        return (sig_name != 'full', signal_dissectors.SEPARATORS[separator]['cost'],
+                separator, sig_name)
+
+    @staticmethod
+    def step_stage(key) -> str:
+        """The build stage a step belongs to. The standard spectrogram is the
+        stft every other spectrogram is made from."""
+        if key[0] == 'signal':
+            return 'decode' if key[1] == 'full' else 'separate'
+        if key[0] == 'spectrograms':
+            return 'stft' if key[2] == 'standard' else 'spectrograms'
+        return 'features'
+
+    @staticmethod
+    def signal_last_uses(steps):
+        """Map step index to the signals that step is the last to read.
+        Separating any signal may read the full signal."""
+        last_use = {}
+        for i, (_stage, key, _fn, _args) in enumerate(steps):
+            last_use[key[1]] = i
+            if key[0] == 'signal' and key[1] != 'full':
+                last_use['full'] = i
+        last_uses = {}
+        for sig_name, i in last_use.items():
+            last_uses.setdefault(i, []).append(sig_name)
+        return last_uses
+
+    @staticmethod
+    def release_signal(plan_output, sig_name, save_signals) -> int:
+        """Drop a signal's stft, and its samples too unless they're being
+        saved. Returns the bytes released."""
+        s_obj = plan_output['signals'].get(sig_name)
+        if s_obj is None:
+            return 0
+        to_release = ['D'] if save_signals else ['y', 'D']
+        nbytes = 0
+        for k in to_release:
+            if s_obj.get(k) is not None:
+                nbytes += plan_output_nbytes(s_obj[k], resident_only=True)
+                s_obj[k] = None
+        return nbytes
+
+    def find_base_store(self, track_name: str, plan):
+        """Find the most recent dnz file of this track made by a plan with the
+        same metadata, other than the one for plan itself."""
+        audio_hash = self.audio_hashes.audio_hash(track_name)
+        target = self.store_file_name(track_name, self.plan_hash_of(plan))
+        candidates = []
+        for dnz_name in glob.glob(os.path.join(self.cache_dir, f'{audio_hash}_*.dnz')):
+            if dnz_name == target:
+                continue
+            try:
+                header = dnz.read_dnz_header(dnz_name)
+            except (dnz.DnzError, OSError):
+                continue
+            if self.comparable_metadata(header['tree']['plan']['metadata']) == \
+                    self.comparable_metadata(plan['metadata']):
+                candidates.append((os.path.getmtime(dnz_name), dnz_name))
+        if not candidates:
+            return None
+        return max(candidates)[1]
+
+    @staticmethod
+    def comparable_metadata(metadata):
+        """The metadata that has to match for outputs to be carried over.
+        Whether signals are saved doesn't change any output."""
+        return {k: v for k, v in metadata.items() if k != 'save_signals'}
+
+    def carry_over_outputs(self, plan_output, base):
+        """Copy everything plan_output asks for that base already has. Outputs
+        base has that plan_output doesn't ask for are dropped, and so are
+        signals the two plans make differently, like spleeter stems from
+        different models. Returns the step keys that no longer need to run."""
+        carried = set()
+        for sig_name, s_obj in plan_output['signals'].items():
+            if sig_name not in base['signals'] or \
+                    signal_params(base['plan'], sig_name) != \
+                    signal_params(plan_output['plan'], sig_name):
+                continue
+            base_obj = base['signals'][sig_name]
+            if base_obj.get('y') is not None:
+                s_obj['y'] = base_obj['y']
+                s_obj['D'] = None
+                carried.add(('signal', sig_name))
+            for kind in ['spectrograms', 'features']:
+                for name in s_obj.get(kind, {}):
+                    if name in base_obj.get(kind, {}):
+                        s_obj[kind][name] = base_obj[kind][name]
+                        carried.add((kind, sig_name, name))
+        return carried
+
+    def artifact_cache(self, track_name: str) -> ArtifactCache:
+        """Get the per artifact cache of a track."""
+        audio_hash = self.audio_hashes.audio_hash(track_name)
+        return ArtifactCache(self.cache_dir, audio_hash)
+
+    def purge_artifacts(self, track_name: str) -> None:
+        """Delete a track's artifact cache. Every plan shares it, so all of
+        them recompute the track's artifacts after this."""
+        logging.info('Purging cached artifacts of %s.', track_name)
+        self.artifact_cache(track_name).purge()
+
+    def store_file_name(self, track_name: str, plan_hash: str = None) -> str:
+        """Constructs store file name from the track's audio hash and the
+        plan hash, the active plan's by default."""
+        audio_hash = self.audio_hashes.audio_hash(track_name)
+        plan_hash = plan_hash or self.plan_hash
+        return os.path.join(self.cache_dir, f'{audio_hash}_{plan_hash}.dnz')
+
+    def store_cache_exists(self, track_name: str, verify: bool = False) -> bool:
+        """Checks if a sound cache exists for the combination of plan and
+        track. Verifying also checks every block's checksum."""
+        dnz_name = self.store_file_name(track_name)
+        if not verify:
+            return dnz.is_valid_dnz(dnz_name, self.plan_hash)
+        try:
+            dnz.load_dnz(dnz_name, self.plan_hash, verify=True)
+        except (dnz.DnzError, OSError):
+            return False
+        return True
 
     def save_store(self, track_name, store) -> None:
-        """Cache store as a pickle."""
-        pickle_name = self.store_file_name(track_name)
+        """Cache store as a dnz file."""
+        plan_hash = self.plan_hash_of(store['plan'])
+        dnz_name = self.store_file_name(track_name, plan_hash)
 
         # Delete full spectrogram since log based one is much smaller.
         # I may add this back and this is a short term solution to drastically
-        # reducing pickle size.
+        # reducing dnz size. Signals go too unless the plan wants them saved.
+        save_signals = store['plan']['metadata'].get('save_signals', True)
         for s in store['signals'].keys():
-            del store['signals'][s]['D']
             store['signals'][s]['D'] = None
-
-        with open(pickle_name, "wb") as f:
-            pickle.dump(store, f)
-
-    def load_store(self, track_name):
-        """Load pickled store."""
-        pickle_name = self.store_file_name(track_name)
-        with open(pickle_name, "rb") as f:
-            return pickle.load(f)
+            if not save_signals:
+                store['signals'][s]['y'] = None
+
+        to_save = store
+        precision = store['plan']['metadata'].get('storage_precision', 'full')
+        if precision == 'reduced':
+            to_save = self.quantize_store(store)
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        sizes = dnz.save_dnz(dnz_name, to_save, plan_hash)
+        if sizes['nbytes'] > 0:
+            logging.info('Saved %s: %.1f MB, %.1fx smaller than full precision.',
+                         dnz_name, sizes['nbytes'] / 1e6,
+                         sizes['full_nbytes'] / sizes['nbytes'])
+
+    def quantize_store(self, store):
+        """Wrap spectrograms and normalized features for reduced precision
+        storage. The store itself is left untouched."""
+        quantized = {'plan': store['plan'], 'signals': {}}
+        for sig, s_obj in store['signals'].items():
+            q_obj = dict(s_obj)
+            if s_obj.get('spectrograms'):
+                q_obj['spectrograms'] = dict(s_obj['spectrograms'])
+                log_db_s = s_obj['spectrograms'].get('custom_log_db')
+                if log_db_s is not None:
+                    lo, hi = spectrogram_variants.LOG_DB_RANGE
+                    q_obj['spectrograms']['custom_log_db'] = dnz.Quantized(
+                        log_db_s, 'linear_uint8', lo, hi)
+            if s_obj.get('features'):
+                q_obj['features'] = dict(s_obj['features'])
+                for f, values in s_obj['features'].items():
+                    if values is not None and \
+                            audio_features.function_listing(f)['normalized']:
+                        q_obj['features'][f] = dnz.Quantized(values, 'float16')
+            quantized['signals'][sig] = q_obj
+        return quantized
+
+    def load_store(self, track_name, plan=None):
+        """Load the dnz store of a plan, the active one by default. Arrays
+        stay memory mapped until they're read."""
+        plan = plan or self.active_plan
+        plan_hash = self.plan_hash_of(plan)
+        dnz_name = self.store_file_name(track_name, plan_hash)
+        plan_output = dnz.load_dnz(dnz_name, plan_hash)
+
+        # Other plans requesting the same data share this file. Swap in the
+        # plan so visualizer settings come from the right place.
+        plan_output['plan'] = copy.deepcopy(plan)
+        return plan_output
@@ -0,0 +1,89 @@
+"""Benchmark HPSS
+Compares the fast approximate HPSS behind the fast_* signals with librosa's
+HPSS behind the librosa_* signals, on the speed and the output.
+
+For example:
+
+python -m whirling.tools.benchmark_hpss --tracks 'My Way.mp3' human.mp3
+
+The error is how far the fast harmonic and percussive magnitudes are from
+librosa's, in dB relative to librosa's. -20 dB means the difference carries
+a hundredth of the energy.
+"""
+
+import time
+import logging
+import argparse
+import coloredlogs
+import numpy as np
+import librosa
+from whirling.signal_transformers.signal_dissectors import fast_hpss
+
+
+def relative_error_db(reference, estimate) -> float:
+    """Energy of the magnitude difference relative to the reference, in dB."""
+    reference, estimate = np.abs(reference), np.abs(estimate)
+    error = np.sum((reference - estimate) ** 2)
+    return 10 * np.log10(error / max(np.sum(reference ** 2), 1e-12) + 1e-12)
+
+
+def benchmark_track(track_name: str, sr: int, n_fft: int, hop_length: int):
+    """Time both HPSS versions on a track and compare their outputs."""
+    y, _sr = librosa.load(track_name, sr=sr)
+    D = librosa.stft(y, n_fft=n_fft, hop_length=hop_length)
+
+    start = time.perf_counter()
+    DH, DP = librosa.decompose.hpss(D, margin=2)
+    librosa_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    fast_DH, fast_DP = fast_hpss(D, margin=2)
+    fast_seconds = time.perf_counter() - start
+
+    return {
+        'duration': len(y) / sr,
+        'librosa_seconds': librosa_seconds,
+        'fast_seconds': fast_seconds,
+        'harmonic_error_db': relative_error_db(DH, fast_DH),
+        'percussive_error_db': relative_error_db(DP, fast_DP)
+    }
+
+
+def parse_options():
+    """Define argparse options."""
+    parser = argparse.ArgumentParser(description='Compare the fast HPSS with'
+                                     ' librosa\'s on speed and output.')
+    parser.add_argument('--tracks', type=str, nargs='+', required=True,
+                        help='Tracks to benchmark on.')
+    parser.add_argument('--sr', type=int, default=22050)
+    parser.add_argument('--n-fft', type=int, default=2048)
+    parser.add_argument('--hop-length', type=int, default=512)
+    return parser.parse_args()
+
+
+def main():
+    """Benchmark every track and print the totals."""
+    coloredlogs.install()
+    args = parse_options()
+    results = []
+    for track_name in args.tracks:
+        result = benchmark_track(track_name, args.sr, args.n_fft, args.hop_length)
+        logging.info('%s: librosa %.2f s, fast %.2f s (%.1fx), harmonic error'
+                     ' %.1f dB, percussive error %.1f dB', track_name,
+                     result['librosa_seconds'], result['fast_seconds'],
+                     result['librosa_seconds'] / result['fast_seconds'],
+                     result['harmonic_error_db'], result['percussive_error_db'])
+        results.append(result)
+
+    librosa_seconds = sum(r['librosa_seconds'] for r in results)
+    fast_seconds = sum(r['fast_seconds'] for r in results)
+    audio_seconds = sum(r['duration'] for r in results)
+    print(f'Audio:            {audio_seconds:.0f} s')
+    print(f'librosa HPSS:     {librosa_seconds:.2f} s')
+    print(f'Fast HPSS:        {fast_seconds:.2f} s ({librosa_seconds / fast_seconds:.1f}x)')
+    print(f'Harmonic error:   {np.mean([r["harmonic_error_db"] for r in results]):.1f} dB')
+    print(f'Percussive error: {np.mean([r["percussive_error_db"] for r in results]):.1f} dB')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+"""Resident memory of the current process.
+
+On Linux these read /proc/self/status, whose peak can be reset to measure a
+stretch of code on its own. Elsewhere they fall back to getrusage, whose peak
+covers the life of the process.
+"""
+
+import resource
+
+
+def _proc_status_mb(field: str):
+    """Read a memory field of /proc/self/status in MB. None off of Linux."""
+    try:
+        with open('/proc/self/status', 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def rss_mb() -> float:
+    """Current resident memory of this process in MB."""
+    current = _proc_status_mb('VmRSS')
+    if current is None:
+        return peak_rss_mb()
+    return current
+
+
+def peak_rss_mb() -> float:
+    """Peak resident memory of this process in MB since the last reset."""
+    peak = _proc_status_mb('VmHWM')
+    if peak is None:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return peak
+
+
+def reset_peak_rss() -> None:
+    """Reset the peak so the next stretch of code can be measured alone."""
+    try:
+        with open('/proc/self/clear_refs', 'w', encoding='utf-8') as f:
+            f.write('5')
+    except OSError:
+        pass
@@ -0,0 +1,239 @@
+"""Loads plan outputs off of the render thread.
+
+Generating a plan output can take minutes when a track hasn't been cached.
+The track loader runs that work on a background worker and holds on to the
+results until the main loop collects them, that way pygame keeps rendering at
+its frame rate the whole time.
+
+The loader also prefetches. While a track plays, the tracks around it get
+loaded at low priority and parked in memory so switching to them is instant.
+Prefetch jobs only run when no track the user is waiting on is queued, and
+by default only load tracks that are already cached. There's one worker and a
+job can't be interrupted, so a prefetch generating a track could hold up the
+track the user switches to for minutes. Prefetches can be let to generate
+anyway, which hides the generation of the next track as long as the user
+doesn't skip ahead of it. A track the user switches to before its prefetch
+starts gets loaded or generated in its place.
+
+Every job loads with the plan it was queued with. When the plan is edited,
+jobs still running with the old one are marked stale, their outputs are
+thrown away and the tracks are queued again with the new plan.
+"""
+
+import queue
+import logging
+import itertools
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from whirling.cache import plan_output_nbytes
+
+
+# Default memory budget for prefetched plan outputs.
+DEFAULT_PREFETCH_BUDGET = 1 << 30
+
+# Queue priorities. Lower runs first.
+FOREGROUND = 0
+PREFETCH = 1
+
+
+class LoadJob():
+    """A track to be loaded with a plan and the future its plan output lands
+    in."""
+
+    def __init__(self, track_name: str, priority: int, plan):
+        self.track_name = track_name
+        self.priority = priority
+        self.plan = plan
+        self.started = False
+        self.generate = False
+        self.stale = False
+        self.future = Future()
+
+
+class TrackLoader():
+    """Runs a load function for tracks on a single background worker. One
+    worker keeps Spleeter and TensorFlow on one thread. The load function
+    takes a track name, a plan and whether to generate the plan output if it
+    isn't cached, and returns None if it isn't and it wasn't generated."""
+
+    def __init__(self, load_fn, prefetch_budget: int = DEFAULT_PREFETCH_BUDGET,
+                 prefetch_generate: bool = False):
+        self.load_fn = load_fn
+        self.prefetch_budget = prefetch_budget
+        self.prefetch_generate = prefetch_generate
+
+        self.lock = threading.Lock()
+        self.jobs = queue.PriorityQueue()
+        self.job_order = itertools.count()
+
+        # Jobs queued or running by track name.
+        self.active_jobs = {}
+
+        # Futures the main loop is waiting on, as (track name, future).
+        self.pending = []
+
+        # Finished prefetches nobody asked for yet, oldest first, as
+        # (plan, plan output).
+        self.prefetched = OrderedDict()
+
+        self.worker = threading.Thread(
+            target=self.run, name='track_loader', daemon=True)
+        self.worker.start()
+
+    def load(self, track_name: str, plan) -> None:
+        """Load a track with a plan for the main loop. Loads queued for other
+        tracks that haven't started yet get cancelled since nobody wants them
+        anymore."""
+        with self.lock:
+            for pending_track, future in self.pending:
+                job = self.active_jobs.get(pending_track)
+                if future.cancel() and job is not None and job.future is future:
+                    self.finish_job(job)
+            self.pending = []
+
+            # Best case it's sitting in the prefetch slot.
+            if track_name in self.prefetched:
+                prefetched_plan, plan_output = self.prefetched.pop(track_name)
+                if prefetched_plan == plan:
+                    future = Future()
+                    future.set_result(plan_output)
+                    self.pending.append((track_name, future))
+                    return
+
+            # Next best it's being prefetched. Bump it to the front. A prefetch
+            # already running that won't generate the track gets a job of its
+            # own queued behind it.
+            job = self.active_jobs.get(track_name)
+            if job is not None and job.plan != plan:
+                self.retire_job(job)
+                job = None
+            if job is None or job.future.cancelled() or \
+                    (job.started and not job.generate):
+                job = LoadJob(track_name, FOREGROUND, plan)
+                self.active_jobs[track_name] = job
+            if not job.started:
+                job.priority = FOREGROUND
+                self.jobs.put((FOREGROUND, next(self.job_order), job))
+            self.pending.append((track_name, job.future))
+
+    def prefetch(self, track_names, plan) -> None:
+        """Load tracks with a plan in the background in anticipation of them
+        being played, if they're cached or prefetches generate. Prefetches of tracks not in this
+        list, or with another plan, are dropped."""
+        with self.lock:
+            wanted = set(track_names)
+            waiting_on = set(track for track, _future in self.pending)
+
+            for track_name, (prefetched_plan, _output) in list(self.prefetched.items()):
+                if track_name not in wanted or prefetched_plan != plan:
+                    del self.prefetched[track_name]
+
+            for track_name, job in list(self.active_jobs.items()):
+                if track_name in waiting_on:
+                    continue
+                if job.plan != plan:
+                    self.retire_job(job)
+                elif track_name not in wanted and not job.started:
+                    job.future.cancel()
+                    del self.active_jobs[track_name]
+
+            for track_name in track_names:
+                if track_name in self.prefetched or track_name in self.active_jobs:
+                    continue
+                job = LoadJob(track_name, PREFETCH, plan)
+                self.active_jobs[track_name] = job
+                self.jobs.put((PREFETCH, next(self.job_order), job))
+
+    def clear_prefetched(self) -> None:
+        """Forget prefetched plan outputs and drop prefetches in flight, like
+        when the plan changes."""
+        with self.lock:
+            self.prefetched.clear()
+            waiting_on = set(track for track, _future in self.pending)
+            for track_name, job in list(self.active_jobs.items()):
+                if track_name not in waiting_on:
+                    self.retire_job(job)
+
+    def poll(self):
+        """Collect finished loads as a list of (track name, plan output).
+        Failed loads are logged and dropped."""
+        finished = []
+        with self.lock:
+            still_pending = []
+            for track_name, future in self.pending:
+                if not future.done():
+                    still_pending.append((track_name, future))
+                elif future.cancelled():
+                    continue
+                elif future.exception() is not None:
+                    logging.error('Failed to load track %s: %s',
+                                  track_name, future.exception())
+                else:
+                    finished.append((track_name, future.result()))
+            self.pending = still_pending
+        return finished
+
+    @property
+    def is_loading(self) -> bool:
+        """Return if the main loop is waiting on any loads."""
+        with self.lock:
+            return any(not future.done() for _track, future in self.pending)
+
+    def run(self):
+        """Worker loop. Pulls the highest priority job and loads it."""
+        while True:
+            _priority, _order, job = self.jobs.get()
+
+            # Jobs can be queued twice when bumped to the foreground.
+            with self.lock:
+                if job.started:
+                    continue
+                if not job.future.set_running_or_notify_cancel():
+                    self.finish_job(job)
+                    continue
+                job.started = True
+                job.generate = job.priority == FOREGROUND or self.prefetch_generate
+
+            try:
+                plan_output = self.load_fn(job.track_name, job.plan, job.generate)
+            except Exception as e:  # pylint: disable=broad-except
+                job.future.set_exception(e)
+                with self.lock:
+                    self.finish_job(job)
+                continue
+
+            with self.lock:
+                self.finish_job(job)
+                waiting_on = any(f is job.future for _track, f in self.pending)
+                if job.priority == PREFETCH and not waiting_on and not job.stale \
+                        and plan_output is not None:
+                    self.park_prefetched(job.track_name, job.plan, plan_output)
+            job.future.set_result(plan_output)
+
+    def finish_job(self, job):
+        """Forget a job once it's done. Must be called with the lock held."""
+        if self.active_jobs.get(job.track_name) is job:
+            del self.active_jobs[job.track_name]
+
+    def retire_job(self, job):
+        """Give up on a job whose plan is out of date. It's cancelled if it
+        hasn't started, otherwise it runs out and its output is dropped, and
+        either way the track can be queued again. Must be called with the lock
+        held."""
+        job.stale = True
+        job.future.cancel()
+        self.finish_job(job)
+
+    def park_prefetched(self, track_name, plan, plan_output):
+        """Hold on to a prefetched plan output, evicting the oldest ones to
+        stay in the memory budget. Must be called with the lock held."""
+        nbytes = plan_output_nbytes(plan_output)
+        if nbytes > self.prefetch_budget:
+            logging.info('Prefetched track %s is over the memory budget.', track_name)
+            return
+
+        self.prefetched[track_name] = (plan, plan_output)
+        while sum(plan_output_nbytes(p) for _plan, p in self.prefetched.values()) \
+                > self.prefetch_budget:
+            self.prefetched.popitem(last=False)
@@ -134,6 +134,16 @@ class UIAudioController(UIDock):
         if is_playing:
             self.player.play()
 
+        self.prefetch_neighbors()
+
+    def prefetch_neighbors(self):
+        """Have the store get a head start on the tracks around this one."""
+        count = len(self.music_tracks)
+        tracks = [self.music_tracks[(self.track_num + 1) % count]]
+        if self.store.prefetch_previous:
+            tracks.append(self.music_tracks[(self.track_num - 1 + count) % count])
+        self.store.prefetch_tracks(tracks)
+
     def play_next_track_if_over(self):
         """ Determine if song is over and should go to next.
         This code is hacky because there are several different signals that
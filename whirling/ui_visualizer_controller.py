@@ -26,13 +26,11 @@ class UIVisualizerController(UIDock):
         # Initialize pygame vars.
         self.font = pg.font.Font(None, 30)
 
-        # Switch to using the first visual.
+        # Switch to using the first visual. The visualizers to cycle through
+        # follow the plan as it's edited.
         self.current_visualizer_bs = Store.get_instance().current_visualizer_bs
-        plan_visualizers = set(Store.get_instance().plan['visualizers'].keys())
-        self.visualizers = [
-            v[0] for v in VISUALIZERS if v[0] in plan_visualizers
-        ]
-        self.next_visual()
+        self.visualizers = []
+        Store.get_instance().active_plan_bs.subscribe(self.on_plan_change)
 
         self.whirling_textures = WhirlingTextures()
         self.initialize_elements()
@@ -75,6 +73,20 @@ class UIVisualizerController(UIDock):
 
         self.elements.append(self.visualizer_name)
 
+    def on_plan_change(self, plan):
+        """Refresh the visualizers from the plan, switching away from the
+        current one if the plan dropped it."""
+        plan_visualizers = set(plan['visualizers'].keys())
+        self.visualizers = [
+            v[0] for v in VISUALIZERS if v[0] in plan_visualizers
+        ]
+        current_visualizer: str = self.current_visualizer_bs.value
+        if current_visualizer not in self.visualizers:
+            if self.visualizers:
+                self.current_visualizer_bs.on_next(self.visualizers[0])
+            else:
+                self.next_visual()
+
     def change_visualizer_name(self, text):
         """Handles changes to the visualizer name."""
         self.visualizer_name.text = f'Visualizer: {text}'
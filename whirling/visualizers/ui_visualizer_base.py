@@ -8,8 +8,9 @@ from abc import ABC, abstractmethod
 from OpenGL.GL import *  # pylint: disable=unused-wildcard-import,redefined-builtin,wildcard-import
 from OpenGL.GLU import *  # pylint: disable=unused-wildcard-import,redefined-builtin,wildcard-import
 from OpenGL.GLUT import *  # pylint: disable=unused-wildcard-import,redefined-builtin,wildcard-import
+from whirling.ui_core import colors
 from whirling.ui_core.primitives import Rect
-from whirling.ui_core.ui_core import UIElement
+from whirling.ui_core.ui_core import UIElement, UIText
 from whirling.ui_audio_controller import UIAudioController
 from whirling.signal_transformers import audio_features
 from whirling.store import Store
@@ -21,6 +22,7 @@ class UIVisualizerBase(UIElement, ABC):
 
         self.audio_controller = audio_controller
         self.data = None
+        self.loading_text = None
 
         self.store = Store.get_instance()
         self.sub = self.store.is_plan_loaded_bs.subscribe(
@@ -32,8 +34,38 @@ class UIVisualizerBase(UIElement, ABC):
 
         if self.data:
             self.draw_visuals()
-        #else:
-        #    Render loading screen.
+        else:
+            self.draw_loading_screen()
+
+    def draw_loading_screen(self):
+        """Render the load progress of the current track."""
+        progress = self.store.load_progress_bs.value
+        text = f'Loading: {progress.stage} ({int(100 * progress.fraction)}%)'
+
+        # Only re-render the text when it changes.
+        if self.loading_text is None:
+            pos = (self.rect.left + 0.1 * self.width,
+                   self.rect.bottom + 0.5 * self.height + 20)
+            self.loading_text = UIText(text, pos, font_size=30)
+        elif self.loading_text.text != text:
+            self.loading_text.text = text
+        self.loading_text.draw()
+
+        # Draw progress bar.
+        left = 0.1 * self.width
+        right = left + 0.8 * self.width * progress.fraction
+        bottom = 0.5 * self.height - 10
+        top = 0.5 * self.height
+        glLoadIdentity()
+        glTranslate(*self.rect.position)
+        glColor3fv(colors.GRAY)
+        glBegin(GL_QUADS)
+        glVertex2f(left, bottom)
+        glVertex2f(left, top)
+        glVertex2f(right, top)
+        glVertex2f(right, bottom)
+        glEnd()
+        glLoadIdentity()
 
     @abstractmethod
     def draw_visuals(self):